@@ -80,7 +80,7 @@ class DrawIBModel:
         self.__parse_key_number()
 
         # (4) 根据之前解析集合架构的结果，读取obj对象内容到字典中
-        self.__obj_name_ib_dict:dict[str,list] = {} 
+        self.__obj_name_ib_dict:dict[str,numpy.ndarray] = {} 
         self.__obj_name_category_buffer_list_dict:dict[str,list] =  {} 
         self.obj_name_drawindexed_dict:dict[str,M_DrawIndexed] = {} # 给每个obj的属性统计好，后面就能直接用了。
         self.__obj_name_index_vertex_id_dict:dict[str,dict] = {} # 形态键功能必备
@@ -292,21 +292,18 @@ class DrawIBModel:
                     # print("processing: " + obj_name)
                     ib = self.__obj_name_ib_dict.get(obj_name,None)
 
-                    # ib的数据类型是list[int]
-                    unique_vertex_number_set = set(ib)
-                    unique_vertex_number = len(unique_vertex_number_set)
-
                     if ib is None:
                         print("Can't find ib object for " + obj_name +",skip this obj process.")
                         continue
 
-                    offset_ib = []
-                    for ib_number in ib:
-                        offset_ib.append(ib_number + vertex_number_ib_offset)
+                    # ib的数据类型是numpy.uint32的ndarray
+                    unique_vertex_number = len(numpy.unique(ib))
+
+                    offset_ib = ib + vertex_number_ib_offset
                     
                     # print("Component name: " + component_name)
                     # print("Draw Offset: " + str(vertex_number_ib_offset))
-                    ib_buf.extend(offset_ib)
+                    ib_buf.append(offset_ib)
 
                     drawindexed_obj = M_DrawIndexed()
                     draw_number = len(offset_ib)
@@ -324,6 +321,7 @@ class DrawIBModel:
                     # LOG.newline()
         # 累加完毕后draw_offset的值就是总的index_count的值，正好作为WWMI的$object_id
         self.total_index_count = draw_offset
+        ib_buf = numpy.concatenate(ib_buf) if len(ib_buf) != 0 else numpy.empty(0, dtype=numpy.uint32)
 
         for component_name, moel_collection_list in self.componentname_modelcollection_list_dict.items():
             # Only export if it's not empty.
@@ -347,21 +345,18 @@ class DrawIBModel:
                     # print("processing: " + obj_name)
                     ib = self.__obj_name_ib_dict.get(obj_name,None)
 
-                    # ib的数据类型是list[int]
-                    unique_vertex_number_set = set(ib)
-                    unique_vertex_number = len(unique_vertex_number_set)
-
                     if ib is None:
                         print("Can't find ib object for " + obj_name +",skip this obj process.")
                         continue
 
-                    offset_ib = []
-                    for ib_number in ib:
-                        offset_ib.append(ib_number + vertex_number_ib_offset)
+                    # ib的数据类型是numpy.uint32的ndarray
+                    unique_vertex_number = len(numpy.unique(ib))
+
+                    offset_ib = ib + vertex_number_ib_offset
                     
                     # print("Component name: " + component_name)
                     # print("Draw Offset: " + str(vertex_number_ib_offset))
-                    ib_buf.extend(offset_ib)
+                    ib_buf.append(offset_ib)
 
                     drawindexed_obj = M_DrawIndexed()
                     draw_number = len(offset_ib)
@@ -381,6 +376,7 @@ class DrawIBModel:
 
                     # LOG.newline()
             
+            ib_buf = numpy.concatenate(ib_buf) if len(ib_buf) != 0 else numpy.empty(0, dtype=numpy.uint32)
             # Only export if it's not empty.
             if len(ib_buf) != 0:
                 self.componentname_ibbuf_dict[component_name] = ib_buf
@@ -573,9 +569,8 @@ class DrawIBModel:
             else:
                 ib_path = buf_output_folder + self.PartName_IBBufferFileName_Dict[partname]
 
-                packed_data = struct.pack(f'<{len(ib_buf)}I', *ib_buf)
                 with open(ib_path, 'wb') as ibf:
-                    ibf.write(packed_data) 
+                    ib_buf.astype('<u4', copy=False).tofile(ibf)
             
             if MainConfig.get_game_category() == GameCategory.UnrealVS or MainConfig.get_game_category() == GameCategory.UnrealCS: 
                 break
@@ -1,13 +1,13 @@
 import numpy
 import bpy
-import collections
 import math
+import functools
 
 from ..utils.obj_utils import ObjUtils
 from ..utils.timer_utils import TimerUtils
 from ..utils.migoto_utils import Fatal, MigotoUtils
 
-from .d3d11_game_type import D3D11GameType
+from .d3d11_game_type import D3D11GameType, D3D11Element
 
 from ..config.generate_mod_config import GenerateModConfig 
 from ..config.main_config import MainConfig,GameCategory
@@ -39,16 +39,52 @@ class BufferDataConverter:
     def dot_product(cls,v1, v2):
         return sum(a * b for a, b in zip(v1, v2))
 
+    @classmethod
+    def scale_and_round(cls, input_array, scale, dtype):
+        '''
+        乘以scale后四舍五入并转换为dtype
+        只分配一个float32临时数组，乘法和取整都原地完成，避免每一步都分配新数组
+        '''
+        # BLENDINDICES这种整数输入不需要取整，保持原本的整数运算
+        if not numpy.issubdtype(input_array.dtype, numpy.floating):
+            return (input_array * scale).astype(dtype)
+
+        scratch = numpy.multiply(input_array, scale, dtype=numpy.float32)
+        numpy.rint(scratch, out=scratch)
+        return scratch.astype(dtype)
+
     '''
     这四个UNORM和SNORM比较特殊需要这样处理，其它float类型转换直接astype就行
     '''
+    @classmethod
+    def get_format_converter(cls, fmt:str):
+        '''
+        返回float32数据转换到fmt时需要调用的转换函数，直接写入字段就能完成转换的返回None
+        '''
+        if fmt == 'R8G8B8A8_SNORM':
+            return cls.convert_4x_float32_to_r8g8b8a8_snorm
+        elif fmt == 'R8G8B8A8_UNORM':
+            return cls.convert_4x_float32_to_r8g8b8a8_unorm
+        return None
+
     @classmethod
     def convert_4x_float32_to_r8g8b8a8_snorm(cls, input_array):
-        return numpy.round(input_array * 127).astype(numpy.int8)
+        return cls.scale_and_round(input_array, 127, numpy.int8)
     
+    # 1.5 * 2^23，float32加上它之后尾数的低位就是四舍五入(round half to even)后的整数
+    ROUND_MAGIC_FLOAT32 = numpy.float32(12582912.0)
+
     @classmethod
     def convert_4x_float32_to_r8g8b8a8_unorm(cls,input_array):
-        return numpy.round(input_array * 255).astype(numpy.uint8)
+        # BLENDINDICES这种整数输入不需要取整，保持原本的整数运算
+        if not numpy.issubdtype(input_array.dtype, numpy.floating):
+            return cls.scale_and_round(input_array, 255, numpy.uint8)
+
+        # UNORM范围是[0,1]，先截断再加上magic数，直接从float32的位中取出整数，不需要再调用rint
+        scratch = numpy.clip(input_array, 0.0, 1.0).astype(numpy.float32, copy=False)
+        scratch *= numpy.float32(255.0)
+        scratch += cls.ROUND_MAGIC_FLOAT32
+        return (scratch.view(numpy.uint32) & 0xFF).astype(numpy.uint8)
     
     @classmethod
     def normalize_weights(cls, weights):
@@ -114,12 +150,36 @@ class BufferDataConverter:
     
     @classmethod
     def convert_4x_float32_to_r16g16b16a16_unorm(cls, input_array):
-        return numpy.round(input_array * 65535).astype(numpy.uint16)
+        return cls.scale_and_round(input_array, 65535, numpy.uint16)
     
     @classmethod
     def convert_4x_float32_to_r16g16b16a16_snorm(cls, input_array):
-        return numpy.round(input_array * 32767).astype(numpy.uint16)
+        return cls.scale_and_round(input_array, 32767, numpy.uint16)
     
+    @classmethod
+    def group_by_position(cls,positions):
+        '''
+        按POSITION对顶点分组，位置完全相同的顶点属于同一组。
+        返回排序索引、每组在排序后的起始下标、每个顶点所属的组号。
+        没有顶点时三者都是空数组。
+        '''
+        if len(positions) == 0:
+            empty_indices = numpy.empty(0, dtype=numpy.intp)
+            return empty_indices, empty_indices, empty_indices
+
+        # 对位置进行排序，以便相同的位置会相邻
+        sort_indices = numpy.lexsort(positions.T)
+        sorted_positions = positions[sort_indices]
+
+        # 排序后只需线性扫描一遍相邻元素，找出位置变化的地方，即我们需要分组的地方
+        position_changed = numpy.any(sorted_positions[1:] != sorted_positions[:-1], axis=1)
+        group_starts = numpy.flatnonzero(numpy.r_[True, position_changed])
+
+        # 组号就是位置变化次数的前缀和
+        position_indices = numpy.empty(len(positions), dtype=numpy.intp)
+        position_indices[sort_indices] = numpy.cumsum(numpy.r_[0, position_changed])
+        return sort_indices, group_starts, position_indices
+
     @classmethod
     def average_normal_tangent(cls,obj,indexed_vertices,d3d11GameType,dtype):
         '''
@@ -140,47 +200,30 @@ class BufferDataConverter:
         if not allow_calc:
             return indexed_vertices
         
-        # 不用担心这个转换的效率，速度非常快
-        vb = bytearray()
-        for vertex in indexed_vertices:
-            vb += bytes(vertex)
-        vb = numpy.frombuffer(vb, dtype = dtype)
-
-        # 开始重计算TANGENT
-        positions = numpy.array([val['POSITION'] for val in vb])
-        normals = numpy.array([val['NORMAL'] for val in vb], dtype=float)
-
-        # 对位置进行排序，以便相同的位置会相邻
-        sort_indices = numpy.lexsort(positions.T)
-        sorted_positions = positions[sort_indices]
-        sorted_normals = normals[sort_indices]
+        # indexed_vertices已经是去重后的结构化数组，直接在上面修改
+        vb = indexed_vertices
 
-        # 找出位置变化的地方，即我们需要分组的地方
-        group_indices = numpy.flatnonzero(numpy.any(sorted_positions[:-1] != sorted_positions[1:], axis=1))
-        group_indices = numpy.r_[0, group_indices + 1, len(sorted_positions)]
+        # 开始重计算TANGENT，直接使用结构化数组的字段视图
+        sort_indices, group_starts, position_indices = cls.group_by_position(vb['POSITION'])
+        sorted_normals = vb['NORMAL'][sort_indices].astype(float)
 
-        # 累加法线和计算计数
-        unique_positions = sorted_positions[group_indices[:-1]]
-        accumulated_normals = numpy.add.reduceat(sorted_normals, group_indices[:-1], axis=0)
-        counts = numpy.diff(group_indices)
+        # 累加法线
+        accumulated_normals = numpy.add.reduceat(sorted_normals, group_starts, axis=0)
 
-        # 归一化累积法线向量
-        normalized_normals = accumulated_normals / numpy.linalg.norm(accumulated_normals, axis=1)[:, numpy.newaxis]
-        normalized_normals[numpy.isnan(normalized_normals)] = 0  # 处理任何可能出现的零向量导致的除零错误
-
-        # 构建结果字典
-        position_normal_dict = dict(zip(map(tuple, unique_positions), normalized_normals))
+        # 归一化累积法线向量，先求长度平方再乘以长度的倒数
+        # 零向量的倒数直接置为0，不会出现除零产生的NaN
+        squared_lengths = numpy.einsum('ij,ij->i', accumulated_normals, accumulated_normals)
+        inverse_lengths = numpy.zeros_like(squared_lengths)
+        numpy.divide(1.0, numpy.sqrt(squared_lengths), out=inverse_lengths, where=squared_lengths > 0)
+        normalized_normals = accumulated_normals * inverse_lengths[:, numpy.newaxis]
 
         # TimerUtils.End("Recalculate TANGENT")
 
-        # 获取所有位置并转换为元组，用于查找字典
-        positions = [tuple(pos) for pos in vb['POSITION']]
-
-        # 从字典中获取对应的标准化法线
-        normalized_normals = numpy.array([position_normal_dict[pos] for pos in positions])
+        # 按分组取出每个顶点对应的标准化法线
+        normalized_normals = normalized_normals[position_indices]
 
-        # 计算 w 并调整 tangent 的第四个分量
-        w = numpy.where(vb['TANGENT'][:, 3] >= 0, -1.0, 1.0)
+        # 计算 w 并调整 tangent 的第四个分量，直接翻转原符号，不需要额外的bool掩码
+        w = -numpy.copysign(1.0, vb['TANGENT'][:, 3])
 
         # 更新 TANGENT 分量，注意这里的切片操作假设 TANGENT 有四个分量
         vb['TANGENT'][:, :3] = normalized_normals
@@ -208,27 +251,16 @@ class BufferDataConverter:
         # 开始重计算COLOR
         TimerUtils.Start("Recalculate COLOR")
 
-        # 不用担心这个转换的效率，速度非常快
-        vb = bytearray()
-        for vertex in indexed_vertices:
-            vb += bytes(vertex)
-        vb = numpy.frombuffer(vb, dtype = dtype)
+        # indexed_vertices已经是去重后的结构化数组，直接在上面修改
+        vb = indexed_vertices
 
-        # 首先提取所有唯一的位置，并创建一个索引映射
-        unique_positions, position_indices = numpy.unique(
-            [tuple(val['POSITION']) for val in vb], 
-            return_inverse=True, 
-            axis=0
-        )
+        # 首先按位置分组，得到每个顶点所属唯一位置的索引映射
+        sort_indices, group_starts, position_indices = cls.group_by_position(vb['POSITION'])
 
-        # 初始化累积法线和计数器为零
-        accumulated_normals = numpy.zeros((len(unique_positions), 3), dtype=float)
-        counts = numpy.zeros(len(unique_positions), dtype=int)
-
-        # 累加法线并增加计数（这里假设vb是一个list）
-        for i, val in enumerate(vb):
-            accumulated_normals[position_indices[i]] += numpy.array(val['NORMAL'], dtype=float)
-            counts[position_indices[i]] += 1
+        # 按顶点顺序一次性累加法线并统计计数
+        accumulated_normals = numpy.zeros((len(group_starts), 3), dtype=float)
+        numpy.add.at(accumulated_normals, position_indices, vb['NORMAL'].astype(float))
+        counts = numpy.bincount(position_indices, minlength=len(group_starts))
 
         # 对所有位置的法线进行一次性规范化处理
         mask = counts > 0
@@ -238,22 +270,14 @@ class BufferDataConverter:
         # 归一化到[0,1]，然后映射到颜色值
         normalized_normals = ((average_normals + 1) / 2 * 255).astype(numpy.uint8)
 
-        # 更新颜色信息
-        new_color = []
-        for i, val in enumerate(vb):
-            color = [0, 0, 0, val['COLOR'][3]]  # 保留原来的Alpha通道
-            
-            if mask[position_indices[i]]:
-                color[:3] = normalized_normals[position_indices[i]]
-
-            new_color.append(color)
-
-        # 将新的颜色列表转换为NumPy数组
-        new_color_array = numpy.array(new_color, dtype=numpy.uint8)
+        # 更新颜色信息，没有有效法线的位置RGB保持为0
+        new_color_array = numpy.zeros((len(vb), 4), dtype=numpy.uint8)
+        valid_vertices = mask[position_indices]
+        new_color_array[valid_vertices, :3] = normalized_normals[position_indices[valid_vertices]]
+        new_color_array[:, 3] = vb['COLOR'][:, 3]  # 保留原来的Alpha通道
 
         # 更新vb中的颜色信息
-        for i, val in enumerate(vb):
-            val['COLOR'] = new_color_array[i]
+        vb['COLOR'] = new_color_array
 
         TimerUtils.End("Recalculate COLOR")
         return vb
@@ -269,7 +293,53 @@ class BufferModel:
 
         self.dtype = None
         self.element_vertex_ndarray  = None
+        self.loop_vertex_indices = None
+        self.loop_attribute_dict = None
+        self.blendindices = None
+        self.blendweights = None
+
+        # 需要从mesh.loops中通过foreach_get获取的属性及其分量数，构造时就确定好
+        self.loop_attribute_components:dict[str,int] = self.get_loop_attribute_components()
+        # 每个Element对应的解析函数，构造时就确定好
+        self.element_handlers:list = self.build_element_handlers()
         
+    def get_loop_attribute_components(self) -> dict:
+        '''
+        统计NORMAL和TANGENT需要从mesh.loops中获取的属性，以及每个属性的分量数
+        '''
+        loop_attribute_components = {}
+        game_category = MainConfig.get_game_category()
+
+        if "NORMAL" in self.d3d11GameType.OrderedFullElementList:
+            loop_attribute_components["normal"] = 3
+            if self.d3d11GameType.ElementNameD3D11ElementDict["NORMAL"].Format == 'R8G8B8A8_SNORM':
+                if game_category == GameCategory.UnrealVS or game_category == GameCategory.UnrealCS:
+                    loop_attribute_components["bitangent_sign"] = 1
+
+        if "TANGENT" in self.d3d11GameType.OrderedFullElementList:
+            loop_attribute_components["tangent"] = 3
+            if game_category == GameCategory.UnityCS or game_category == GameCategory.UnityVS:
+                loop_attribute_components["bitangent_sign"] = 1
+
+        return loop_attribute_components
+
+    def get_loop_attribute_dict(self,mesh_loops) -> dict:
+        '''
+        所有loop属性共用一块连续的float32缓冲区，每个属性对应其中连续的一段
+        这样只需要分配一次内存，并且每段都是连续的，foreach_get可以直接内存拷贝
+        '''
+        mesh_loops_length = len(mesh_loops)
+        loop_attribute_buffer = numpy.empty(mesh_loops_length * sum(self.loop_attribute_components.values()), dtype=numpy.float32)
+
+        loop_attribute_dict = {}
+        buffer_offset = 0
+        for attribute_name, components in self.loop_attribute_components.items():
+            attribute_buffer = loop_attribute_buffer[buffer_offset:buffer_offset + mesh_loops_length * components]
+            mesh_loops.foreach_get(attribute_name, attribute_buffer)
+            loop_attribute_dict[attribute_name] = attribute_buffer.reshape(-1, components) if components > 1 else attribute_buffer
+            buffer_offset += mesh_loops_length * components
+        return loop_attribute_dict
+
     def check_and_verify_attributes(self,obj:bpy.types.Object):
         '''
         校验并补全部分元素
@@ -299,6 +369,42 @@ class BufferModel:
                 if not obj.vertex_groups:
                     raise Fatal("your object [" +obj.name + "] need at leat one valid Vertex Group, Please check if your model's Vertex Group is correct.")
 
+    def build_element_handlers(self) -> list:
+        '''
+        d3d11GameType在构造时就已经确定，所以提前确定好每个Element对应的解析函数、分量数和Format转换函数
+        解析时只需要按顺序调用，不需要每次都走一遍if/elif和Format判断
+        '''
+        element_handlers = []
+        for d3d11_element_name in self.d3d11GameType.OrderedFullElementList:
+            d3d11_element = self.d3d11GameType.ElementNameD3D11ElementDict[d3d11_element_name]
+            format_converter = BufferDataConverter.get_format_converter(d3d11_element.Format)
+
+            if d3d11_element_name == 'POSITION':
+                handler = self.parse_position
+            elif d3d11_element_name == 'NORMAL':
+                handler = self.parse_normal
+            elif d3d11_element_name == 'TANGENT':
+                handler = self.parse_tangent
+            elif d3d11_element_name.startswith('COLOR'):
+                handler = self.parse_color
+            elif d3d11_element_name.startswith('TEXCOORD') and d3d11_element.Format.endswith('FLOAT'):
+                handler = self.parse_texcoord
+            elif d3d11_element_name.startswith('BLENDINDICES'):
+                handler = self.parse_blendindices
+            elif d3d11_element_name.startswith('BLENDWEIGHT'):
+                # patch时跳过生成数据
+                if self.d3d11GameType.PatchBLENDWEIGHTS:
+                    continue
+                handler = self.parse_blendweights
+                if d3d11_element.Format == 'R8G8B8A8_UNORM':
+                    format_converter = BufferDataConverter.convert_4x_float32_to_r8g8b8a8_unorm_blendweights
+            else:
+                continue
+
+            components = MigotoUtils.format_components(d3d11_element.Format)
+            element_handlers.append((d3d11_element_name, functools.partial(handler, d3d11_element, components, format_converter)))
+        return element_handlers
+
     def parse_elementname_ravel_ndarray_dict(self,mesh:bpy.types.Mesh) -> dict:
         '''
         - 注意这里是从mesh.loops中获取数据，而不是从mesh.vertices中获取数据
@@ -308,8 +414,6 @@ class BufferModel:
 
         mesh_loops = mesh.loops
         mesh_loops_length = len(mesh_loops)
-        mesh_vertices = mesh.vertices
-        mesh_vertices_length = len(mesh.vertices)
 
         self.dtype = numpy.dtype([])
 
@@ -337,306 +441,237 @@ class BufferModel:
         # 创建一个包含所有循环顶点索引的NumPy数组
         loop_vertex_indices = numpy.empty(mesh_loops_length, dtype=int)
         mesh_loops.foreach_get("vertex_index", loop_vertex_indices)
+        self.loop_vertex_indices = loop_vertex_indices
 
-        # TimerUtils.Start("GET BLEND") # 0:00:00.141898 
-        max_groups = 4
+        # 只有需要BLENDINDICES或BLENDWEIGHTS时才去统计顶点组
+        if any(d3d11_element_name.startswith("BLEND") for d3d11_element_name, handler in self.element_handlers):
+            self.parse_blend(mesh, blendweights_formatlen)
 
-        # Extract and sort the top 4 groups by weight for each vertex.
-        sorted_groups = [
-            sorted(v.groups, key=lambda x: x.weight, reverse=True)[:max_groups]
-            for v in mesh_vertices
-        ]
+        # 一次性获取NORMAL和TANGENT需要的所有loop属性
+        self.loop_attribute_dict = self.get_loop_attribute_dict(mesh_loops)
 
-        # Initialize arrays to hold all groups and weights with zeros.
-        all_groups = numpy.zeros((len(mesh_vertices), max_groups), dtype=int)
-        all_weights = numpy.zeros((len(mesh_vertices), max_groups), dtype=numpy.float32)
+        # 对每一种Element都调用构造时确定好的解析函数获取对应的数据
+        for d3d11_element_name, handler in self.element_handlers:
+            handler(mesh)
 
+    def parse_blend(self,mesh:bpy.types.Mesh,blendweights_formatlen:int):
+        '''
+        统计每个loop权重最大的4个顶点组，结果保存在blendindices和blendweights中
+        '''
+        mesh_vertices = mesh.vertices
+        mesh_vertices_length = len(mesh.vertices)
 
-        # Fill the pre-allocated arrays with group indices and weights.
-        for v_index, groups in enumerate(sorted_groups):
-            num_groups = min(len(groups), max_groups)
-            all_groups[v_index, :num_groups] = [g.group for g in groups][:num_groups]
-            all_weights[v_index, :num_groups] = [g.weight for g in groups][:num_groups]
+        # TimerUtils.Start("GET BLEND") # 0:00:00.141898 
+        max_groups = 4
 
-        # Initialize the blendindices and blendweights with zeros.
-        blendindices = numpy.zeros((mesh_loops_length, max_groups), dtype=numpy.uint32)
-        blendweights = numpy.zeros((mesh_loops_length, max_groups), dtype=numpy.float32)
+        # Flatten every vertex's groups into flat arrays with a single pass over the vertices.
+        group_counts = numpy.empty(mesh_vertices_length, dtype=int)
+        flat_groups = []
+        flat_weights = []
+        for v_index, v in enumerate(mesh_vertices):
+            vertex_groups = v.groups
+            group_counts[v_index] = len(vertex_groups)
+            for g in vertex_groups:
+                flat_groups.append(g.group)
+                flat_weights.append(g.weight)
+
+        # Scatter the flat arrays into zero padded (vertex, column) matrices.
+        max_columns = max(int(group_counts.max(initial=0)), max_groups)
+        row_indices = numpy.repeat(numpy.arange(mesh_vertices_length), group_counts)
+        column_indices = numpy.arange(len(flat_groups)) - numpy.repeat(numpy.cumsum(group_counts) - group_counts, group_counts)
+
+        padded_groups = numpy.zeros((mesh_vertices_length, max_columns), dtype=int)
+        padded_weights = numpy.zeros((mesh_vertices_length, max_columns), dtype=numpy.float32)
+        padded_groups[row_indices, column_indices] = flat_groups
+        padded_weights[row_indices, column_indices] = flat_weights
+
+        # Select the top 4 groups by weight for each vertex.
+        # A stable sort keeps equal weights in their original order, same as sorted(reverse=True) did,
+        # and the zero padding always sorts after the real groups so missing slots stay (0, 0.0).
+        top_columns = numpy.argsort(-padded_weights, axis=1, kind='stable')[:, :max_groups]
+        all_groups = numpy.take_along_axis(padded_groups, top_columns, axis=1)
+        all_weights = numpy.take_along_axis(padded_weights, top_columns, axis=1)
 
         # Map from loop_vertex_indices to precomputed data using advanced indexing.
-        valid_mask = (0 <= numpy.array(loop_vertex_indices)) & (numpy.array(loop_vertex_indices) < len(mesh_vertices))
-        valid_indices = loop_vertex_indices[valid_mask]
-
-        blendindices[valid_mask] = all_groups[valid_indices]
-        blendweights[valid_mask] = all_weights[valid_indices]
+        # Every loop of a valid triangulated mesh points at an existing vertex, so no mask is needed.
+        blendindices = all_groups[self.loop_vertex_indices].astype(numpy.uint32)
+        blendweights = all_weights[self.loop_vertex_indices]
 
         # XXX 必须对当前obj对象执行权重规格化，否则模型细分后会导致模型坑坑洼洼
         if "Blend" in self.d3d11GameType.OrderedCategoryNameList:
             if blendweights_formatlen > 1:
                 blendweights = blendweights / numpy.sum(blendweights, axis=1)[:, None]
 
+        self.blendindices = blendindices
+        self.blendweights = blendweights
         # TimerUtils.End("GET BLEND")
 
-        # 对每一种Element都获取对应的数据
-        for d3d11_element_name in self.d3d11GameType.OrderedFullElementList:
-            d3d11_element = self.d3d11GameType.ElementNameD3D11ElementDict[d3d11_element_name]
-
-            if d3d11_element_name == 'POSITION':
-                # TimerUtils.Start("Position Get")
-                vertex_coords = numpy.empty(mesh_vertices_length * 3, dtype=numpy.float32)
-                # Notice: 'undeformed_co' is static, don't need dynamic calculate like 'co' so it is faster.
-                mesh_vertices.foreach_get('undeformed_co', vertex_coords)
+    def parse_position(self,d3d11_element:D3D11Element,components:int,format_converter,mesh:bpy.types.Mesh):
+        # TimerUtils.Start("Position Get")
+        vertex_coords = numpy.empty(len(mesh.vertices) * 3, dtype=numpy.float32)
+        # Notice: 'undeformed_co' is static, don't need dynamic calculate like 'co' so it is faster.
+        mesh.vertices.foreach_get('undeformed_co', vertex_coords)
 
-                positions = vertex_coords.reshape(-1, 3)[loop_vertex_indices]
-                if d3d11_element.Format == 'R16G16B16A16_FLOAT':
-                    positions = positions.astype(numpy.float16)
-                    new_array = numpy.zeros((positions.shape[0], 4))
-                    new_array[:, :3] = positions
-                    positions = new_array
+        # 直接写入结构化数组的字段视图，赋值时会自动完成float16转换，R16G16B16A16_FLOAT的w分量保持为0
+        self.element_vertex_ndarray[d3d11_element.ElementName][:, :3] = vertex_coords.reshape(-1, 3)[self.loop_vertex_indices]
+        # TimerUtils.End("Position Get") # 0:00:00.057535 
 
-                self.element_vertex_ndarray[d3d11_element_name] = positions
-                # TimerUtils.End("Position Get") # 0:00:00.057535 
+    def parse_normal(self,d3d11_element:D3D11Element,components:int,format_converter,mesh:bpy.types.Mesh):
+        normals = self.loop_attribute_dict["normal"]
 
-            elif d3d11_element_name == 'NORMAL':
-                if d3d11_element.Format == 'R16G16B16A16_FLOAT':
-                    result = numpy.ones(mesh_loops_length * 4, dtype=numpy.float32)
-                    normals = numpy.empty(mesh_loops_length * 3, dtype=numpy.float32)
-                    mesh_loops.foreach_get('normal', normals)
-                    result[0::4] = normals[0::3]
-                    result[1::4] = normals[1::3]
-                    result[2::4] = normals[2::3]
-                    result = result.reshape(-1, 4)
-
-                    result = result.astype(numpy.float16)
-                    self.element_vertex_ndarray[d3d11_element_name] = result
-
-                elif d3d11_element.Format == 'R8G8B8A8_SNORM':
-                    result = numpy.ones(mesh_loops_length * 4, dtype=numpy.float32)
-                    normals = numpy.empty(mesh_loops_length * 3, dtype=numpy.float32)
-                    mesh_loops.foreach_get('normal', normals)
-                    result[0::4] = normals[0::3]
-                    result[1::4] = normals[1::3]
-                    result[2::4] = normals[2::3]
-                    
-
-                    if MainConfig.get_game_category() == GameCategory.UnrealVS or MainConfig.get_game_category() == GameCategory.UnrealCS:
-                        bitangent_signs = numpy.empty(mesh_loops_length, dtype=numpy.float32)
-                        mesh_loops.foreach_get("bitangent_sign", bitangent_signs)
-                        result[3::4] = bitangent_signs
-
-                        # XXX 3.6和3.2都需要翻转一下，原因未知
-                        if bpy.app.version < (4,0,0):
-                            result[0::4] *= -1
-                            result[1::4] *= -1
-                            result[2::4] *= -1
-                        # print("Unreal: Set NORMAL.W to bitangent_sign")
-                    
-                    result = result.reshape(-1, 4)
-
-                    self.element_vertex_ndarray[d3d11_element_name] = BufferDataConverter.convert_4x_float32_to_r8g8b8a8_snorm(result)
-
-
-                elif d3d11_element.Format == 'R8G8B8A8_UNORM':
-                    result = numpy.ones(mesh_loops_length * 4, dtype=numpy.float32)
-                    normals = numpy.empty(mesh_loops_length * 3, dtype=numpy.float32)
-                    mesh_loops.foreach_get('normal', normals)
-                    result[0::4] = normals[0::3]
-                    result[1::4] = normals[1::3]
-                    result[2::4] = normals[2::3]
-                    result = result.reshape(-1, 4)
-
-                    self.element_vertex_ndarray[d3d11_element_name] = BufferDataConverter.convert_4x_float32_to_r8g8b8a8_unorm(new_array)
-
-                else:
-                    result = numpy.empty(mesh_loops_length * 3, dtype=numpy.float32)
-                    mesh_loops.foreach_get('normal', result)
-                    # 将一维数组 reshape 成 (mesh_loops_length, 3) 形状的二维数组
-                    result = result.reshape(-1, 3)
-                    self.element_vertex_ndarray[d3d11_element_name] = result
+        if components == 3:
+            self.element_vertex_ndarray[d3d11_element.ElementName] = normals
 
+        elif format_converter is None:
+            # R16G16B16A16_FLOAT直接写入float16的字段视图，不再生成中间数组
+            normal_field = self.element_vertex_ndarray[d3d11_element.ElementName]
+            normal_field[:, :3] = normals
+            normal_field[:, 3] = 1
 
-            elif d3d11_element_name == 'TANGENT':
-                result = numpy.empty(mesh_loops_length * 4, dtype=numpy.float32)
-
-                # 使用 foreach_get 批量获取切线和副切线符号数据
-                tangents = numpy.empty(mesh_loops_length * 3, dtype=numpy.float32)
-                mesh_loops.foreach_get("tangent", tangents)
-                # 将切线分量放置到输出数组中
-                result[0::4] = tangents[0::3]  # x 分量
-                result[1::4] = tangents[1::3]  # y 分量
-                result[2::4] = tangents[2::3]  # z 分量
-
-                if MainConfig.get_game_category() == GameCategory.UnityCS or MainConfig.get_game_category() == GameCategory.UnityVS:
-                    bitangent_signs = numpy.empty(mesh_loops_length, dtype=numpy.float32)
-                    mesh_loops.foreach_get("bitangent_sign", bitangent_signs)
-                    # XXX 将副切线符号乘以 -1
-                    # 这里翻转（翻转指的就是 *= -1）是因为如果要确保Unity游戏中渲染正确，必须翻转TANGENT的W分量
-                    bitangent_signs *= -1
-                    result[3::4] = bitangent_signs  # w 分量 (副切线符号)
-                elif MainConfig.get_game_category() == GameCategory.UnrealVS or MainConfig.get_game_category() == GameCategory.UnrealCS:
-                    # Unreal引擎中这里要填写固定的1
-                    tangent_w = numpy.ones(mesh_loops_length, dtype=numpy.float32)
-                    result[3::4] = tangent_w
+        else:
+            result = numpy.ones((len(normals), 4), dtype=numpy.float32)
+            result[:, :3] = normals
+
+            if d3d11_element.Format == 'R8G8B8A8_SNORM':
+                if MainConfig.get_game_category() == GameCategory.UnrealVS or MainConfig.get_game_category() == GameCategory.UnrealCS:
+                    result[:, 3] = self.loop_attribute_dict["bitangent_sign"]
+
+                    # XXX 3.6和3.2都需要翻转一下，原因未知
+                    if bpy.app.version < (4,0,0):
+                        result[:, :3] *= -1
+                    # print("Unreal: Set NORMAL.W to bitangent_sign")
+
+            self.element_vertex_ndarray[d3d11_element.ElementName] = format_converter(result)
+
+    def parse_tangent(self,d3d11_element:D3D11Element,components:int,format_converter,mesh:bpy.types.Mesh):
+        tangents = self.loop_attribute_dict["tangent"]
+
+        # 直接分配 (mesh_loops_length, 4) 形状的二维数组，一次写入xyz，一次写入w
+        result = numpy.empty((len(tangents), 4), dtype=numpy.float32)
+        # 将切线分量放置到输出数组中
+        result[:, :3] = tangents
+
+        if MainConfig.get_game_category() == GameCategory.UnityCS or MainConfig.get_game_category() == GameCategory.UnityVS:
+            # XXX 将副切线符号乘以 -1
+            # 这里翻转（翻转指的就是 *= -1）是因为如果要确保Unity游戏中渲染正确，必须翻转TANGENT的W分量
+            numpy.negative(self.loop_attribute_dict["bitangent_sign"], out=result[:, 3])  # w 分量 (副切线符号)
+        elif MainConfig.get_game_category() == GameCategory.UnrealVS or MainConfig.get_game_category() == GameCategory.UnrealCS:
+            # Unreal引擎中这里要填写固定的1
+            result[:, 3] = 1
+
+        # R16G16B16A16_FLOAT在写入字段时会自动完成float16转换
+        if format_converter is not None:
+            result = format_converter(result)
+
+        self.element_vertex_ndarray[d3d11_element.ElementName] = result
+
+    def parse_color(self,d3d11_element:D3D11Element,components:int,format_converter,mesh:bpy.types.Mesh):
+        # TimerUtils.Start("Get COLOR")
+        d3d11_element_name = d3d11_element.ElementName
+        if d3d11_element_name in mesh.vertex_colors:
+            # 因为COLOR属性存储在Blender里固定是float32类型所以这里只能用numpy.float32
+            result = numpy.zeros(len(mesh.loops), dtype=(numpy.float32, 4))
+            mesh.vertex_colors[d3d11_element_name].data.foreach_get("color", result.ravel())
+
+            # R16G16B16A16_FLOAT在写入字段时会自动完成float16转换
+            if format_converter is not None:
+                result = format_converter(result)
+
+            # R16G16_FLOAT只需要前两个分量
+            self.element_vertex_ndarray[d3d11_element_name] = result[:, :components]
+
+        # TimerUtils.End("Get COLOR") # 0:00:00.030605 
+
+    def parse_texcoord(self,d3d11_element:D3D11Element,components:int,format_converter,mesh:bpy.types.Mesh):
+        # TimerUtils.Start("GET TEXCOORD")
+        d3d11_element_name = d3d11_element.ElementName
+        for uv_name in ('%s.xy' % d3d11_element_name, '%s.zw' % d3d11_element_name):
+            # 只按名称查找一次uv_layer
+            uv_layer = mesh.uv_layers.get(uv_name)
+            if uv_layer is not None:
+                uvs_array = numpy.empty(len(mesh.loops) ,dtype=(numpy.float32,2))
+                uv_layer.data.foreach_get("uv",uvs_array.ravel())
+                # 原地翻转V分量，不生成临时数组
+                numpy.subtract(1.0, uvs_array[:,1], out=uvs_array[:,1])
+
+                # R16G16_FLOAT在写入字段时会自动完成float16转换
                 
-                # 重塑 output_tangents 成 (mesh_loops_length, 4) 形状的二维数组
-                result = result.reshape(-1, 4)
-
-                if d3d11_element.Format == 'R16G16B16A16_FLOAT':
-                    result = result.astype(numpy.float16)
-
-                elif d3d11_element.Format == 'R8G8B8A8_SNORM':
-                    result = BufferDataConverter.convert_4x_float32_to_r8g8b8a8_snorm(result)
+                # 重塑 uvs_array 成 (mesh_loops_length, 2) 形状的二维数组
+                # uvs_array = uvs_array.reshape(-1, 2)
+
+                self.element_vertex_ndarray[d3d11_element_name] = uvs_array 
+        # TimerUtils.End("GET TEXCOORD")
+
+    def parse_blendindices(self,d3d11_element:D3D11Element,components:int,format_converter,mesh:bpy.types.Mesh):
+        # R32G32_UINT、R32_UINT这些只需要前几个分量，R8G8B8A8_UINT在写入字段时会自动转换
+        blendindices = self.blendindices[:, :components]
+        if format_converter is not None:
+            blendindices = format_converter(blendindices)
+        self.element_vertex_ndarray[d3d11_element.ElementName] = blendindices
+
+    def parse_blendweights(self,d3d11_element:D3D11Element,components:int,format_converter,mesh:bpy.types.Mesh):
+        # R32G32_FLOAT只需要前两个分量
+        # R8G8B8A8_UNORM使用的是convert_4x_float32_to_r8g8b8a8_unorm_blendweights
+        blendweights = self.blendweights[:, :components]
+        if format_converter is not None:
+            blendweights = format_converter(blendweights)
+        self.element_vertex_ndarray[d3d11_element.ElementName] = blendweights
+
+    def unique_element_vertex(self,element_vertex_ndarray):
+        '''
+        按字节对所有loop的顶点数据去重，返回IB和去重后的顶点数组
 
-                elif d3d11_element.Format == 'R8G8B8A8_UNORM':
-                    result = BufferDataConverter.convert_4x_float32_to_r8g8b8a8_unorm(result)
+        - 每个loop的顶点数据看作一个定长的numpy.void，直接交给numpy.unique排序去重，不用再逐个调用tobytes()
+        - 三角化之后mesh.loops就是按polygon顺序排列的，每3个loop一个三角形，所以loop的顺序就是IB的顺序
+        '''
+        element_vertex_void = element_vertex_ndarray.view(numpy.dtype((numpy.void, self.dtype.itemsize)))
+        _, first_loop_indices, unique_inverse = numpy.unique(element_vertex_void, return_index=True, return_inverse=True)
 
-                self.element_vertex_ndarray[d3d11_element_name] = result
+        # numpy.unique的结果是按字节排序的，这里按每个唯一顶点第一次出现的顺序重新编号
+        # 保证导出的顶点顺序和之前用OrderedDict去重的结果完全一致
+        unique_order = numpy.argsort(first_loop_indices)
+        unique_rank = numpy.empty(len(unique_order), dtype=numpy.intp)
+        unique_rank[unique_order] = numpy.arange(len(unique_order))
+        ib = unique_rank[unique_inverse.reshape(-1)]
 
-            elif d3d11_element_name.startswith('COLOR'):
-                # TimerUtils.Start("Get COLOR")
-
-                if d3d11_element_name in mesh.vertex_colors:
-                    # 因为COLOR属性存储在Blender里固定是float32类型所以这里只能用numpy.float32
-                    result = numpy.zeros(mesh_loops_length, dtype=(numpy.float32, 4))
-                    mesh.vertex_colors[d3d11_element_name].data.foreach_get("color", result.ravel())
-                    
-                    if d3d11_element.Format == 'R16G16B16A16_FLOAT':
-                        result = result.astype(numpy.float16)
-                    elif d3d11_element.Format == "R16G16_FLOAT":
-                        result = result[:, :2]
-                    elif d3d11_element.Format == 'R8G8B8A8_UNORM':
-                        result = BufferDataConverter.convert_4x_float32_to_r8g8b8a8_unorm(result)
-
-                    self.element_vertex_ndarray[d3d11_element_name] = result
-
-                # TimerUtils.End("Get COLOR") # 0:00:00.030605 
-            elif d3d11_element_name.startswith('TEXCOORD') and d3d11_element.Format.endswith('FLOAT'):
-                # TimerUtils.Start("GET TEXCOORD")
-                for uv_name in ('%s.xy' % d3d11_element_name, '%s.zw' % d3d11_element_name):
-                    if uv_name in mesh.uv_layers:
-                        uvs_array = numpy.empty(mesh_loops_length ,dtype=(numpy.float32,2))
-                        mesh.uv_layers[uv_name].data.foreach_get("uv",uvs_array.ravel())
-                        uvs_array[:,1] = 1.0 - uvs_array[:,1]
-
-                        if d3d11_element.Format == 'R16G16_FLOAT':
-                            uvs_array = uvs_array.astype(numpy.float16)
-                        
-                        # 重塑 uvs_array 成 (mesh_loops_length, 2) 形状的二维数组
-                        # uvs_array = uvs_array.reshape(-1, 2)
-
-                        self.element_vertex_ndarray[d3d11_element_name] = uvs_array 
-                # TimerUtils.End("GET TEXCOORD")
-                        
-            elif d3d11_element_name.startswith('BLENDINDICES'):
-                
-                if d3d11_element.Format == "R32G32B32A32_SINT":
-                    self.element_vertex_ndarray[d3d11_element_name] = blendindices
-                elif d3d11_element.Format == "R32G32B32A32_UINT":
-                    self.element_vertex_ndarray[d3d11_element_name] = blendindices
-                elif d3d11_element.Format == "R32G32_UINT":
-                    self.element_vertex_ndarray[d3d11_element_name] = blendindices[:, :2]
-                elif d3d11_element.Format == "R32_UINT":
-                    self.element_vertex_ndarray[d3d11_element_name] = blendindices[:, :1]
-                elif d3d11_element.Format == 'R8G8B8A8_SNORM':
-                    self.element_vertex_ndarray[d3d11_element_name] = BufferDataConverter.convert_4x_float32_to_r8g8b8a8_snorm(blendindices)
-                elif d3d11_element.Format == 'R8G8B8A8_UNORM':
-                    self.element_vertex_ndarray[d3d11_element_name] = BufferDataConverter.convert_4x_float32_to_r8g8b8a8_unorm(blendindices)
-                elif d3d11_element.Format == 'R8G8B8A8_UINT':
-                    blendindices.astype(numpy.uint8)
-                    self.element_vertex_ndarray[d3d11_element_name] = blendindices
-                
-            elif d3d11_element_name.startswith('BLENDWEIGHT'):
-                # patch时跳过生成数据
-                if not self.d3d11GameType.PatchBLENDWEIGHTS:
-                    if d3d11_element.Format == "R32G32B32A32_FLOAT":
-                        self.element_vertex_ndarray[d3d11_element_name] = blendweights
-                    elif d3d11_element.Format == "R32G32_FLOAT":
-                        self.element_vertex_ndarray[d3d11_element_name] = blendweights[:, :2]
-                    elif d3d11_element.Format == 'R8G8B8A8_SNORM':
-                        self.element_vertex_ndarray[d3d11_element_name] = BufferDataConverter.convert_4x_float32_to_r8g8b8a8_snorm(blendweights)
-                    elif d3d11_element.Format == 'R8G8B8A8_UNORM':
-                        # self.element_vertex_ndarray[d3d11_element_name] = BufferDataConverter.convert_4x_float32_to_r8g8b8a8_unorm(blendweights)
-                        self.element_vertex_ndarray[d3d11_element_name] = BufferDataConverter.convert_4x_float32_to_r8g8b8a8_unorm_blendweights(blendweights)
+        indexed_vertices = element_vertex_ndarray[first_loop_indices[unique_order]]
+        return ib, indexed_vertices
 
     def calc_index_vertex_buffer(self,obj,mesh:bpy.types.Mesh):
         '''
         计算IndexBuffer和CategoryBufferDict并返回
 
-        这里是速度瓶颈，23万顶点情况下测试，前面的获取mesh数据只用了1.5秒
-        但是这里两个步骤加起来用了6秒，占了4/5运行时间。
-        不过暂时也够用了，先不管了。
+        这里曾经是速度瓶颈，23万顶点情况下测试，前面的获取mesh数据只用了1.5秒
+        但是这里用Python字典逐个loop去重加起来用了6秒，占了4/5运行时间。
+        现在改为numpy.unique一次性去重。
         '''
         # TimerUtils.Start("Calc IB VB")
         # (1) 统计模型的索引和唯一顶点
+        element_vertex_ndarray = self.element_vertex_ndarray
         
-        
-        if GenerateModConfig.export_same_number() and "TANGENT" in self.d3d11GameType.OrderedFullElementList:
+        export_same_number = GenerateModConfig.export_same_number() and "TANGENT" in self.d3d11GameType.OrderedFullElementList
+        if export_same_number:
             '''
             保持相同顶点数时，让相同顶点使用相同的TANGENT值来避免增加索引数和顶点数。
             这里我们使用每个顶点第一次出现的TANGENT值。
-            效率比下面的低50%，不过能使用这个选项的场景只有导入直接导出原模型，所以总运行时间基本都在0.4秒以内，用户感觉不到差距的，没问题。
             '''
-            # 创建一个空列表用于存储最终的结果
-            index_vertex_id_dict = {}
-            ib = []
-            indexed_vertices = collections.OrderedDict()
-            # 一个字典确保每个符合条件的position只出现过一次
-            position_normal_sharedtangent_dict = {}
-            # 遍历每个多边形（polygon）
-            for poly in mesh.polygons:
-                # 创建一个临时列表用于存储当前多边形的索引
-                vertex_indices = []
-                
-                # 遍历当前多边形中的每一个环（loop），根据多边形的起始环和环总数
-                for blender_lvertex in mesh.loops[poly.loop_start:poly.loop_start + poly.loop_total]:
-                    vertex_data_get = self.element_vertex_ndarray[blender_lvertex.index].copy()
-                    poskey = tuple(vertex_data_get['POSITION'] + vertex_data_get['NORMAL'])
-                    if poskey in position_normal_sharedtangent_dict:
-                        tangent_var = position_normal_sharedtangent_dict[poskey]
-                        vertex_data_get['TANGENT'] = tangent_var
-                    else:
-                        tangent_var = vertex_data_get['TANGENT']
-                        position_normal_sharedtangent_dict[poskey] = tangent_var
-                    
-                    vertex_data = vertex_data_get.tobytes()
-                    index = indexed_vertices.setdefault(vertex_data, len(indexed_vertices))
-                    vertex_indices.append(index)
-                    index_vertex_id_dict[index] = blender_lvertex.vertex_index
-                
-                # 将当前多边形的顶点索引列表添加到最终结果列表中
-                ib.append(vertex_indices)
+            # 以POSITION + NORMAL作为键分组，lexsort是稳定排序，所以每组排序后的第一个就是loop顺序中第一次出现的
+            shared_tangent_keys = element_vertex_ndarray['POSITION'] + element_vertex_ndarray['NORMAL']
+            sort_indices, group_starts, key_indices = BufferDataConverter.group_by_position(shared_tangent_keys)
+            first_loop_indices = sort_indices[group_starts]
+
+            element_vertex_ndarray = element_vertex_ndarray.copy()
+            element_vertex_ndarray['TANGENT'] = element_vertex_ndarray['TANGENT'][first_loop_indices[key_indices]]
+
+        ib, indexed_vertices = self.unique_element_vertex(element_vertex_ndarray)
+        # IB直接保持为ndarray，不再转换为Python list
+        flattened_ib = ib.astype(numpy.uint32)
+
+        index_vertex_id_dict = {}
+        # 鸣潮架构必须获取每个draw的索引对应的顶点索引，以保证形态键数据能够正确获取
+        if export_same_number or MainConfig.get_game_category() == GameCategory.UnrealCS or MainConfig.get_game_category() == GameCategory.UnrealVS:
+            index_vertex_id_dict = dict(zip(ib.tolist(), self.loop_vertex_indices.tolist()))
 
-            # print("长度：")
-            # print(len(position_normal_sharedtangent_dict))
-        else:
-            '''
-            不保持相同顶点时，仍然使用我们经典而又快速的方法
-            '''
-            index_vertex_id_dict = {}
-            indexed_vertices = collections.OrderedDict()
-            # 最快的方法，但是由于要兼容鸣潮架构，所以只有在Unity游戏中能用
-            if MainConfig.get_game_category() == GameCategory.UnityCS or MainConfig.get_game_category() == GameCategory.UnityVS:
-                
-                ib = [[indexed_vertices.setdefault(self.element_vertex_ndarray[blender_lvertex.index].tobytes(), len(indexed_vertices))
-                        for blender_lvertex in mesh.loops[poly.loop_start:poly.loop_start + poly.loop_total]
-                            ]for poly in mesh.polygons] 
-            
-            # 很显然上面注释掉的才是最快的，但是没办法，我们必须得获取每个draw的索引对应的顶点索引，以保证形态键数据能够正确获取
-            elif MainConfig.get_game_category() == GameCategory.UnrealCS or MainConfig.get_game_category() == GameCategory.UnrealVS:
-                ib = []
-                for poly in mesh.polygons:
-                    loop_indices = []
-                    for blender_lvertex in mesh.loops[poly.loop_start:poly.loop_start + poly.loop_total]:
-                        vertex_bytes = self.element_vertex_ndarray[blender_lvertex.index].tobytes()
-                        index = indexed_vertices.setdefault(vertex_bytes, len(indexed_vertices))
-                        loop_indices.append(index)
-                        # 在这里可以执行额外的操作，例如：
-                        # print(f"Processed vertex with bytes {vertex_bytes}")
-                        # 或者更新其他状态
-                        index_vertex_id_dict[index] = blender_lvertex.vertex_index
-                    ib.append(loop_indices)   
-
-
-        flattened_ib = [item for sublist in ib for item in sublist]
         # TimerUtils.End("Calc IB VB")
 
         indexed_vertices = BufferDataConverter.average_normal_tangent(obj=obj, indexed_vertices=indexed_vertices, d3d11GameType=self.d3d11GameType,dtype=self.dtype)
@@ -649,10 +684,11 @@ class BufferModel:
         for categoryname,category_stride in self.d3d11GameType.CategoryStrideDict.items():
             category_buffer_dict[categoryname] = []
 
-        data_matrix = numpy.array([numpy.frombuffer(byte_data,dtype=numpy.uint8) for byte_data in indexed_vertices])
+        # 直接把结构化数组看作 (顶点数, 步长) 的uint8矩阵，不再逐个顶点复制
+        data_matrix = indexed_vertices.view(numpy.uint8).reshape(len(indexed_vertices), self.dtype.itemsize)
         stride_offset = 0
         for categoryname,category_stride in category_stride_dict.items():
-            category_buffer_dict[categoryname] = data_matrix[:,stride_offset:stride_offset + category_stride].flatten()
+            category_buffer_dict[categoryname] = numpy.ascontiguousarray(data_matrix[:,stride_offset:stride_offset + category_stride]).reshape(-1)
             stride_offset += category_stride
         # TimerUtils.End("Calc CategoryBuffer")
         return flattened_ib,category_buffer_dict,index_vertex_id_dict
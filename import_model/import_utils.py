@@ -1,11 +1,26 @@
 import os
 import bpy
 import json
+import functools
 import subprocess
 from ..config.main_config import *
 from ..utils.json_utils import *
 from ..utils.migoto_utils import Fatal
 
+# Blender自带的Python里一般没有orjson，有的话就用它解析，否则退回标准库json
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+
+# tmp.json按(路径,修改时间)缓存，同一次会话里重复读取不再重新打开和解析文件，文件被改写后mtime变化会自动重新读取
+@functools.lru_cache(maxsize=64)
+def _load_tmp_json(tmp_json_path:str, mtime:float) -> dict:
+    with open(tmp_json_path, 'rb') as tmp_json_file:
+        return _json_loads(tmp_json_file.read())
+
 class DrawIBPair:
 
     def __init__(self):
@@ -52,19 +67,21 @@ class ImportUtils:
             # print("DrawIB:", draw_ib)
             import_drawib_folder_path = os.path.join(output_folder_path, draw_ib)
 
-            if not os.path.exists(import_drawib_folder_path):
+            # os.scandir直接返回名称、路径和缓存的文件类型，不需要为每个子目录额外调用stat
+            try:
+                with os.scandir(import_drawib_folder_path) as entries:
+                    for entry in entries:
+                        dirname = entry.name
+                        if not dirname.startswith("TYPE_") or not entry.is_dir():
+                            continue
+                        final_import_folder_path = entry.path
+                        if dirname.startswith("TYPE_GPU"):
+                            gpu_import_folder_path_list.append(final_import_folder_path)
+                        elif dirname.startswith("TYPE_CPU"):
+                            cpu_import_folder_path_list.append(final_import_folder_path)
+            except FileNotFoundError:
                 continue
 
-            dirs = os.listdir(import_drawib_folder_path)
-            for dirname in dirs:
-                if not dirname.startswith("TYPE_"):
-                    continue
-                final_import_folder_path = os.path.join(import_drawib_folder_path,dirname)
-                if dirname.startswith("TYPE_GPU"):
-                    gpu_import_folder_path_list.append(final_import_folder_path)
-                elif dirname.startswith("TYPE_CPU"):
-                    cpu_import_folder_path_list.append(final_import_folder_path)
-
             if len(gpu_import_folder_path_list) != 0:
                 final_import_folder_path_dict[draw_ib + "_" + alias_name] = gpu_import_folder_path_list[0]
             elif len(cpu_import_folder_path_list) != 0:
@@ -85,10 +102,9 @@ class ImportUtils:
         drawib = os.path.basename(import_folder_path)
 
         if os.path.exists(tmp_json_path):
-            tmp_json_file = open(tmp_json_path)
-            tmp_json = json.load(tmp_json_file)
-            tmp_json_file.close()
-            import_prefix_list = tmp_json["ImportModelList"]
+            tmp_json = _load_tmp_json(tmp_json_path, os.path.getmtime(tmp_json_path))
+            # 缓存里的列表是共享的，返回副本
+            import_prefix_list = list(tmp_json["ImportModelList"])
             if len(import_prefix_list) == 0:
                 import_partname_prefix_list = []
                 partname_list = tmp_json["PartNameList"]
@@ -104,12 +120,12 @@ class ImportUtils:
 
     @classmethod
     def read_tmp_json(cls,import_folder_path:str) ->dict:
+        '''
+        返回的字典是缓存里共享的那一份，只能读取不能修改，需要修改的话请自己复制一份
+        '''
         tmp_json_path = os.path.join(import_folder_path, "tmp.json")
         if os.path.exists(tmp_json_path):
-            tmp_json_file = open(tmp_json_path)
-            tmp_json = json.load(tmp_json_file)
-            tmp_json_file.close()
-            return tmp_json
+            return _load_tmp_json(tmp_json_path, os.path.getmtime(tmp_json_path))
         else:
             raise Fatal("Target tmp.json didn't exists: " + tmp_json_path)
 
@@ -16,6 +16,7 @@ import io
 import textwrap
 import collections
 import math
+import numpy
 
 
 @dataclass
@@ -193,6 +194,27 @@ class InputLayoutElement(object):
     def decode(self, data):
         return self.decoder(data)
 
+    def get_numpy_dtype(self):
+        '''
+        返回这个元素在结构化dtype中对应的字段类型，例如R32G32B32_FLOAT返回(float32,(3,))
+        '''
+        return (MigotoUtils.get_nptype_from_format(self.Format), (self.format_len,))
+
+    def normalize_column(self, column:numpy.ndarray) -> numpy.ndarray:
+        '''
+        UNORM和SNORM和decode一样转换成[0,1]和[-1,1]范围的float32，其它格式原样复制一份
+        返回的数组不再引用传进来的缓冲区，缓冲区可以是随后就要关闭的mmap
+        '''
+        if MigotoUtils.unorm16_pattern.match(self.Format):
+            return (column / 65535.0).astype(numpy.float32)
+        elif MigotoUtils.unorm8_pattern.match(self.Format):
+            return (column / 255.0).astype(numpy.float32)
+        elif MigotoUtils.snorm16_pattern.match(self.Format):
+            return (column / 32767.0).astype(numpy.float32)
+        elif MigotoUtils.snorm8_pattern.match(self.Format):
+            return (column / 127.0).astype(numpy.float32)
+        return column.copy()
+
     def __eq__(self, other):
         return \
                 self.SemanticName == other.SemanticName and \
@@ -229,6 +251,18 @@ class InputLayout(object):
                 return True
         return False
 
+    def get_numpy_dtype(self) -> numpy.dtype:
+        '''
+        用每个元素的ElementName、格式和AlignedByteOffset构建整个顶点的结构化dtype，itemsize就是stride
+        '''
+        elems = list(self.elems.values())
+        return numpy.dtype({
+            'names': [elem.name for elem in elems],
+            'formats': [elem.get_numpy_dtype() for elem in elems],
+            'offsets': [elem.AlignedByteOffset for elem in elems],
+            'itemsize': self.stride
+        })
+
     def parse_element(self, f):
         elem = InputLayoutElement(f)
         self.elems[elem.name] = elem
@@ -264,6 +298,50 @@ class InputLayout(object):
         return self.elems == other.elems
 
 
+class FmtFile(object):
+    '''
+    .fmt文件只读取解析一次，VertexBuffer和IndexBuffer都从这里取各自需要的信息
+    '''
+    def __init__(self, f, layout=None):
+        self.byte_offset = 0
+        self.first_vertex = 0
+        self.vertex_count = 0
+        self.first_index = 0
+        self.index_count = 0
+        self.topology = 'trianglelist'
+        self.format = 'DXGI_FORMAT_UNKNOWN'
+        self.gametypename = ""
+        self.layout = layout and layout or InputLayout()
+
+        for line in map(str.strip, f):
+            if line.startswith('byte offset:'):
+                self.byte_offset = int(line[13:])
+            elif line.startswith('first vertex:'):
+                self.first_vertex = int(line[14:])
+            elif line.startswith('vertex count:'):
+                self.vertex_count = int(line[14:])
+            elif line.startswith('first index:'):
+                self.first_index = int(line[13:])
+            elif line.startswith('index count:'):
+                self.index_count = int(line[13:])
+            elif line.startswith('stride:'):
+                self.layout.stride = int(line[7:])
+            elif line.startswith('element['):
+                self.layout.parse_element(f)
+            elif line.startswith('topology:'):
+                self.topology = line[10:]
+                if line != 'topology: trianglelist':
+                    raise Fatal('"%s" is not yet supported' % line)
+            elif line.startswith('format:'):
+                self.format = line[8:]
+            elif line.startswith('gametypename:'):
+                self.gametypename = line[14:]
+
+    @classmethod
+    def from_fmt(cls, fmt_path:str):
+        with open(fmt_path, 'r') as f:
+            return cls(f)
+
 
 class IndexBuffer(object):
     def __init__(self, *args):
@@ -276,12 +354,16 @@ class IndexBuffer(object):
         self.topology = 'trianglelist'
 
         # 如果是IOBase类型，说明是以文件名称初始化的，此时fmt要从文件中解析
+        # 如果是FmtFile类型，说明fmt已经解析过了，直接使用
         if len(args) == 0:
             # 如果不填写参数，则默认为DXGI_FORMAT_R32_UINT类型
             self.format = "DXGI_FORMAT_R32_UINT"
         elif isinstance(args[0], io.IOBase):
             assert (len(args) == 1)
             self.parse_fmt(args[0])
+        elif isinstance(args[0], FmtFile):
+            assert (len(args) == 1)
+            self.load_fmt_file(args[0])
         else:
             self.format, = args
 
@@ -292,42 +374,34 @@ class IndexBuffer(object):
         self.index_count += len(face)
 
     def parse_fmt(self, f):
-        for line in map(str.strip, f):
-            if line.startswith('byte offset:'):
-                self.offset = int(line[13:])
-            if line.startswith('first index:'):
-                self.first = int(line[13:])
-            elif line.startswith('index count:'):
-                self.index_count = int(line[13:])
-            elif line.startswith('topology:'):
-                self.topology = line[10:]
-                if line != 'topology: trianglelist':
-                    raise Fatal('"%s" is not yet supported' % line)
-            elif line.startswith('format:'):
-                self.format = line[8:]
-            elif line.startswith('gametypename:'):
-                self.gametypename = line[14:]
-            elif line == '':
-                    return
-        assert (len(self.faces) * 3 == self.index_count)
-
-    def parse_ib_bin(self, f):
-        f.seek(self.offset)
+        self.load_fmt_file(FmtFile(f))
+
+    def load_fmt_file(self, fmt_file:FmtFile):
+        self.offset = fmt_file.byte_offset
+        self.first = fmt_file.first_index
+        self.index_count = fmt_file.index_count
+        self.topology = fmt_file.topology
+        self.format = fmt_file.format
+        self.gametypename = fmt_file.gametypename
+
+    def parse_ib_bin(self, ib_buffer):
+        '''
+        ib_buffer可以是bytes或者mmap等支持buffer协议的对象，解析后faces是(面数,3)的numpy数组
+        '''
         stride = MigotoUtils.format_size(self.format)
         # XXX: Should we respect the first index?
         # f.seek(self.first * stride, whence=1)
         self.first = 0
 
-        face = []
-        while True:
-            index = f.read(stride)
-            if not index:
-                break
-            face.append(*self.decoder(index))
-            if len(face) == 3:
-                self.faces.append(tuple(face))
-                face = []
-        assert (len(face) == 0)
+        nptype = MigotoUtils.get_nptype_from_format(self.format)
+        if self.offset >= len(ib_buffer):
+            # byte offset超出文件长度时和原来seek后read不到数据一样，得到空的faces
+            self.faces = numpy.empty((0, 3), dtype=nptype)
+        else:
+            index_count = (len(ib_buffer) - self.offset) // stride
+            assert (index_count % 3 == 0)
+            indices = numpy.frombuffer(ib_buffer, dtype=nptype, count=index_count, offset=self.offset)
+            self.faces = indices.reshape(-1, 3).copy()
 
         # We intentionally disregard the index count when loading from a
         # binary file, as we assume frame analysis might have only dumped a
@@ -351,14 +425,6 @@ class IndexBuffer(object):
     def __len__(self):
         return len(self.faces) * 3
 
-'''
-TODO 
-
-VertexBuffer的这个架构导入实在是太慢了。
-但是如果更新到使用Numpy的复杂数据类型，会导致现有的ib和vb架构全部需要推倒重写。
-没办法，只能暂时忍受了，反正一般模型导入的时间都不会特别长，在可接受范围内。
-
-'''
 class VertexBuffer(object):
     vb_elem_pattern = re.compile(r'''vb\d+\[\d*\]\+\d+ (?P<semantic>[^:]+): (?P<data>.*)$''')
 
@@ -366,61 +432,45 @@ class VertexBuffer(object):
     # parameters, as they would all share the *same* InputLayout since the
     # default values are only evaluated once on file load
     def __init__(self, f=None, layout=None):
-        # 这里的vertices是3Dmigoto顶点，不是Blender顶点。
-        self.vertices = []
+        # 从.vb文件读取时每个元素单独解析成一列 ElementName -> (顶点数,分量数)的numpy数组
+        self.cols:dict[str,numpy.ndarray] = {}
         self.layout = layout and layout or InputLayout()
         self.first = 0
         self.vertex_count = 0
         self.offset = 0
         self.topology = 'trianglelist'
 
+        # f可以是.fmt文件，也可以是已经解析好的FmtFile
         if f is not None:
-            for line in map(str.strip, f):
-                # print(line)
-                if line.startswith('byte offset:'):
-                    self.offset = int(line[13:])
-                if line.startswith('first vertex:'):
-                    self.first = int(line[14:])
-                if line.startswith('vertex count:'):
-                    self.vertex_count = int(line[14:])
-                if line.startswith('stride:'):
-                    self.layout.stride = int(line[7:])
-                if line.startswith('element['):
-                    self.layout.parse_element(f)
-                if line.startswith('topology:'):
-                    self.topology = line[10:]
-                    if line != 'topology: trianglelist':
-                        raise Fatal('"%s" is not yet supported' % line)
-            assert (len(self.vertices) == self.vertex_count)
-
-    def parse_vb_bin(self, f):
-        f.seek(self.offset)
+            fmt_file = f if isinstance(f, FmtFile) else FmtFile(f, layout=self.layout)
+            self.layout = fmt_file.layout
+            self.offset = fmt_file.byte_offset
+            self.first = fmt_file.first_vertex
+            self.vertex_count = fmt_file.vertex_count
+            self.topology = fmt_file.topology
+
+    def parse_vb_bin(self, vb_buffer, element_names=None):
+        '''
+        vb_buffer可以是bytes或者mmap等支持buffer协议的对象，每列都会复制出来，解析完后就可以关闭
+        element_names不为None时只复制解析其中的元素，例如导入时用不到的TANGENT就不需要解析
+        '''
         # XXX: Should we respect the first/base vertex?
         # f.seek(self.first * self.layout.stride, whence=1)
         self.first = 0
-        while True:
-            vertex = f.read(self.layout.stride)
-            if not vertex:
-                break
-            self.vertices.append(self.layout.decode(vertex))
-        self.vertex_count = len(self.vertices)
-
-    def append(self, vertex):
-        self.vertices.append(vertex)
-        self.vertex_count += 1
-
-    def write(self, output, operator=None):
-        for vertex in self.vertices:
-            output.write(self.layout.encode(vertex))
-
-        msg = 'Wrote %i vertices to %s' % (len(self), output.name)
-        if operator:
-            operator.report({'INFO'}, msg)
+        vertex_dtype = self.layout.get_numpy_dtype()
+        if self.offset >= len(vb_buffer):
+            # byte offset超出文件长度时和原来seek后read不到数据一样，没有任何顶点
+            self.vertex_count = 0
+            vertex_ndarray = numpy.empty(0, dtype=vertex_dtype)
         else:
-            print(msg)
+            self.vertex_count = (len(vb_buffer) - self.offset) // self.layout.stride
+            # 整个文件按InputLayout对应的结构化dtype一次性解释，每个字段就是一列
+            vertex_ndarray = numpy.frombuffer(vb_buffer, dtype=vertex_dtype, count=self.vertex_count, offset=self.offset)
+        self.cols = {elem.name: elem.normalize_column(vertex_ndarray[elem.name]) for elem in self.layout
+                     if element_names is None or elem.name in element_names}
 
     def __len__(self):
-        return len(self.vertices)
+        return self.vertex_count
     
 
     
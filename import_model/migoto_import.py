@@ -10,17 +10,27 @@ from ..utils.json_utils import JsonUtils
 from array import array
 
 import os.path
-import itertools
+import mmap
+import concurrent.futures
+import functools
+import numpy
 import bpy
 import json
 import math
 from mathutils import Vector
 
-from bpy_extras.io_utils import unpack_list, ImportHelper, axis_conversion
+from bpy_extras.io_utils import ImportHelper, axis_conversion
 from bpy.props import BoolProperty, StringProperty, CollectionProperty
 from bpy_extras.io_utils import orientation_helper
 
 
+# 顶点组名称就是编号的字符串，预先生成好避免每次导入都重复str(i)
+_VG_NAMES = tuple(map(str, range(4096)))
+
+# 导入时的坐标轴转换矩阵是固定的，赋值给matrix_world时会复制数值，所以所有物体共用一个即可
+_AXIS_CONV_4x4 = axis_conversion(from_forward='-Z', from_up='Y').to_4x4()
+
+
 def import_shapekeys(mesh, obj, shapekeys):
     if len(shapekeys.keys()) == 0:
         return
@@ -32,6 +42,9 @@ def import_shapekeys(mesh, obj, shapekeys):
     # Set shapekeys to relative 'cause WuWa uses this type
     obj.data.shape_keys.use_relative = True
 
+    vertex_count = len(obj.data.vertices)
+    shapekey_co = numpy.empty(vertex_count * 3, dtype=numpy.float32)
+
     # Import shapekeys
     for shapekey_id in shapekeys.keys():
         # Add new shapekey
@@ -39,12 +52,11 @@ def import_shapekeys(mesh, obj, shapekeys):
         shapekey.interpolation = 'KEY_LINEAR'
 
         # Apply shapekey vertex position offsets to each indexed vertex
-        shapekey_data = shapekeys[shapekey_id]
-        for vertex_id in range(len(obj.data.vertices)):
-            position_offset = shapekey_data[vertex_id]
-            shapekey.data[vertex_id].co.x += position_offset[0]
-            shapekey.data[vertex_id].co.y += position_offset[1]
-            shapekey.data[vertex_id].co.z += position_offset[2]
+        # 新建的形态键初始坐标就是Basis，用foreach_get整块读出来加上偏移后再foreach_set写回，避免逐顶点访问co
+        shapekey.data.foreach_get('co', shapekey_co)
+        position_offsets = numpy.asarray(shapekeys[shapekey_id][:vertex_count], dtype=numpy.float32)
+        shapekey_co.reshape(vertex_count, 3)[:] += position_offsets[:, :3]
+        shapekey.data.foreach_set('co', shapekey_co)
 
 
 def import_vertex_groups(mesh, obj, blend_indices, blend_weights,component):
@@ -73,26 +85,74 @@ def import_vertex_groups(mesh, obj, blend_indices, blend_weights,component):
         # to use the vertex group index, vertex group name or attach some extra
         # data. Make sure the indices and names match:
         if component is None:
-            num_vertex_groups = max(itertools.chain(*itertools.chain(*blend_indices.values()))) + 1
+            num_vertex_groups = max(int(numpy.max(semantic_blend_indices)) for semantic_blend_indices in blend_indices.values()) + 1
         else:
             num_vertex_groups = max(component.vg_map.values()) + 1
         
+        vertex_groups = obj.vertex_groups
         for i in range(num_vertex_groups):
-            obj.vertex_groups.new(name=str(i))
-        for vertex in mesh.vertices:
-            for semantic_index in sorted(blend_indices.keys()):
-                for i, w in zip(blend_indices[semantic_index][vertex.index],
-                                blend_weights[semantic_index][vertex.index]):
-                    if w == 0.0:
-                        continue
-                    if component is None:
-                        obj.vertex_groups[i].add((vertex.index,), w, 'REPLACE')
-                    else:
-                        # 这里由于C++生成的json文件是无序的，所以我们这里读取的时候要用原始的map而不是转换成列表的索引，避免无序问题
-                        obj.vertex_groups[component.vg_map[str(i)]].add((vertex.index,), w, 'REPLACE')
-
-
-def import_uv_layers(mesh, obj, texcoords):
+            vertex_groups.new(name=_VG_NAMES[i] if i < 4096 else str(i))
+
+        # 按顶点、SemanticIndex、分量的顺序把所有(顶点,顶点组,权重)展开成一维数组
+        vertex_count = len(mesh.vertices)
+        vertex_index_list = []
+        group_index_list = []
+        weight_list = []
+        for semantic_index in sorted(blend_indices.keys()):
+            semantic_blend_indices = numpy.asarray(blend_indices[semantic_index], dtype=numpy.int32).reshape(vertex_count, -1)
+            semantic_blend_weights = numpy.asarray(blend_weights[semantic_index], dtype=numpy.float32).reshape(vertex_count, -1)
+            # 和zip一样只取两者都有的分量
+            influence_count = min(semantic_blend_indices.shape[1], semantic_blend_weights.shape[1])
+            vertex_index_list.append(numpy.repeat(numpy.arange(vertex_count, dtype=numpy.int32)[:, None], influence_count, axis=1))
+            group_index_list.append(semantic_blend_indices[:, :influence_count])
+            weight_list.append(semantic_blend_weights[:, :influence_count])
+
+        vertex_indices = numpy.concatenate(vertex_index_list, axis=1).ravel()
+        group_indices = numpy.concatenate(group_index_list, axis=1).ravel()
+        weights = numpy.concatenate(weight_list, axis=1).ravel()
+
+        nonzero_mask = weights != 0.0
+        vertex_indices = vertex_indices[nonzero_mask]
+        group_indices = group_indices[nonzero_mask]
+        weights = weights[nonzero_mask]
+        if len(weights) == 0:
+            return
+
+        if component is not None:
+            # 这里由于C++生成的json文件是无序的，所以我们这里读取的时候要用原始的map而不是转换成列表的索引，避免无序问题
+            # 把vg_map转换成稠密的查找表，没有映射的位置为-1
+            vg_map_lut = numpy.full(max(int(k) for k in component.vg_map.keys()) + 1, -1, dtype=numpy.int32)
+            for k, v in component.vg_map.items():
+                vg_map_lut[int(k)] = int(v)
+            in_range_mask = (group_indices >= 0) & (group_indices < len(vg_map_lut))
+            remapped_group_indices = numpy.full(len(group_indices), -1, dtype=numpy.int32)
+            remapped_group_indices[in_range_mask] = vg_map_lut[group_indices[in_range_mask]]
+            unmapped_mask = remapped_group_indices < 0
+            if numpy.any(unmapped_mask):
+                raise Fatal("BLENDINDICES中的顶点组索引在Metadata.json的vg_map中不存在: " + str(numpy.unique(group_indices[unmapped_mask]).tolist()))
+            group_indices = remapped_group_indices
+
+        # 原来逐个add是REPLACE，同一个顶点在同一个顶点组出现多次时最后一次生效，这里只保留每对(顶点组,顶点)的最后一次
+        pair_keys = group_indices.astype(numpy.int64) * vertex_count + vertex_indices
+        _, last_reversed = numpy.unique(pair_keys[::-1], return_index=True)
+        keep = len(pair_keys) - 1 - last_reversed
+        vertex_indices = vertex_indices[keep]
+        group_indices = group_indices[keep]
+        weights = weights[keep]
+
+        # 按(顶点组,权重)分桶，每个桶只调用一次add
+        order = numpy.lexsort((vertex_indices, weights, group_indices))
+        vertex_indices = vertex_indices[order]
+        group_indices = group_indices[order]
+        weights = weights[order]
+        bucket_starts = numpy.flatnonzero(numpy.concatenate((
+            [True], (group_indices[1:] != group_indices[:-1]) | (weights[1:] != weights[:-1]))))
+        bucket_ends = numpy.append(bucket_starts[1:], len(order))
+        for start, end in zip(bucket_starts.tolist(), bucket_ends.tolist()):
+            obj.vertex_groups[int(group_indices[start])].add(vertex_indices[start:end].tolist(), float(weights[start]), 'REPLACE')
+
+
+def import_uv_layers(mesh, obj, texcoords, loop_vertex_indices:numpy.ndarray):
     for (texcoord, data) in sorted(texcoords.items()):
         '''
         Nico: 在我们的游戏Mod设计中，TEXCOORD只能有两个分量
@@ -112,6 +172,8 @@ def import_uv_layers(mesh, obj, texcoords):
             raise Fatal('Unhandled TEXCOORD dimension: %i' % dim)
         cmap = {'x': 0, 'y': 1, 'z': 2, 'w': 3}
 
+        data_ndarray = numpy.asarray(data, dtype=numpy.float32)
+
         for components in components_list:
             uv_name = 'TEXCOORD%s.%s' % (texcoord and texcoord or '', components)
             if hasattr(mesh, 'uv_textures'):  # 2.79
@@ -123,94 +185,165 @@ def import_uv_layers(mesh, obj, texcoords):
             # Can't find an easy way to flip the display of V in Blender, so
             # add an option to flip it on import & export:
             # 导入时100%必须翻转UV，因为游戏里Dump出来的贴图，就已经是UV翻转的了。
-            flip_uv = lambda uv: (uv[0], 1.0 - uv[1])
-           
-            uvs = [[d[cmap[c]] for c in components] for d in data]
-            for l in mesh.loops:
-                blender_uvs.data[l.index].uv = flip_uv(uvs[l.vertex_index])
-
-
-def import_faces_from_ib(mesh, ib):
-    mesh.loops.add(len(ib.faces) * 3)
-    mesh.polygons.add(len(ib.faces))
-    mesh.loops.foreach_set('vertex_index', unpack_list(ib.faces))
+            loop_uvs = data_ndarray[:, [cmap[c] for c in components]][loop_vertex_indices]
+            loop_uvs[:, 1] = 1.0 - loop_uvs[:, 1]
+            blender_uvs.data.foreach_set('uv', loop_uvs.ravel())
+
+
+def import_faces_from_ib(mesh, ib) -> numpy.ndarray:
+    '''
+    返回每个loop对应的顶点索引，也就是展开后的ib，后面导入COLOR和UV时直接复用，不需要再从mesh.loops里foreach_get
+    '''
+    face_count = len(ib.faces)
+    mesh.loops.add(face_count * 3)
+    mesh.polygons.add(face_count)
+    loop_vertex_indices = numpy.asarray(ib.faces, dtype=numpy.int32).ravel()
+    mesh.loops.foreach_set('vertex_index', loop_vertex_indices)
     # https://docs.blender.org/api/3.6/bpy.types.MeshPolygon.html#bpy.types.MeshPolygon.loop_start
-    mesh.polygons.foreach_set('loop_start', [x * 3 for x in range(len(ib.faces))])
-    mesh.polygons.foreach_set('loop_total', [3] * len(ib.faces))
-
+    mesh.polygons.foreach_set('loop_start', numpy.arange(face_count, dtype=numpy.int32) * 3)
+    mesh.polygons.foreach_set('loop_total', numpy.full(face_count, 3, dtype=numpy.int32))
+    return loop_vertex_indices
+
+
+def import_position(mesh, elem, data:numpy.ndarray, loop_vertex_indices:numpy.ndarray, vertex_data:dict):
+    # Ensure positions are 3-dimensional:
+    if data.shape[1] == 4:
+        if not numpy.all(data[:, 3] == 1.0):
+            raise Fatal('Positions are 4D')
+            # Nico: Blender暂时不支持4D索引，加了也没用，直接不行就报错，转人工处理。
+    # 连续的float32数组foreach_set时Blender可以直接整块拷贝
+    positions = numpy.ascontiguousarray(data[:, :3], dtype=numpy.float32)
+    mesh.vertices.foreach_set('co', positions.ravel())
+
+
+def import_color(mesh, elem, data:numpy.ndarray, loop_vertex_indices:numpy.ndarray, vertex_data:dict):
+    if len(data[0]) <= 3 or 4 == 4:
+        # Nico:实际执行过程中，几乎总会执行这里而不是下面的
+        # 即使是原版的也是设置vertex_color_layer_channels = 4 然后这里or进行比较的，所以总是会执行这里的设计。
+        # 如果是else下面的执行到会百分百报错的。
+        # Either a monochrome/RGB layer, or Blender 2.80 which uses 4
+        # channel layers
+        mesh.vertex_colors.new(name=elem.name)
+        color_layer = mesh.vertex_colors[elem.name].data
+        # 不足4个分量的补0，按loop取出后一次性写入
+        color_ndarray = numpy.zeros((len(data), 4), dtype=numpy.float32)
+        color_ndarray[:, :len(data[0])] = numpy.asarray(data, dtype=numpy.float32)
+        color_layer.foreach_set('color', color_ndarray[loop_vertex_indices].ravel())
+    else:
+        mesh.vertex_colors.new(name=elem.name + '.RGB')
+        mesh.vertex_colors.new(name=elem.name + '.A')
+        color_layer = mesh.vertex_colors[elem.name + '.RGB'].data
+        alpha_layer = mesh.vertex_colors[elem.name + '.A'].data
+        loop_color_ndarray = numpy.asarray(data, dtype=numpy.float32)[loop_vertex_indices]
+        loop_alpha_ndarray = numpy.zeros((len(loop_vertex_indices), 3), dtype=numpy.float32)
+        loop_alpha_ndarray[:, 0] = loop_color_ndarray[:, 3]
+        color_layer.foreach_set('color', loop_color_ndarray[:, :3].ravel())
+        alpha_layer.foreach_set('color', loop_alpha_ndarray.ravel())
+
+
+def import_normal(mesh, elem, data:numpy.ndarray, loop_vertex_indices:numpy.ndarray, vertex_data:dict):
+    vertex_data["use_normals"] = True
+    vertex_data["normals"] = data[:, :3].tolist()
+
+
+def store_semantic_data(key:str, mesh, elem, data:numpy.ndarray, loop_vertex_indices:numpy.ndarray, vertex_data:dict):
+    # BLENDINDICES BLENDWEIGHT TEXCOORD SHAPEKEY 按SemanticIndex保存，后面统一导入
+    vertex_data[key][elem.SemanticIndex] = data
+
+
+def get_vertex_element_handler(elem):
+    '''
+    根据ElementName返回对应的导入函数，返回None表示不需要导入
+    '''
+    if elem.name == 'POSITION':
+        return import_position
+    elif elem.name.startswith('COLOR'):
+        return import_color
+    elif elem.name == 'NORMAL':
+        return import_normal
+    elif elem.name in ('TANGENT', 'BINORMAL'):
+        # 不需要导入TANGENT和BINORMAL，因为导出时会重新计算。
+        return None
+    elif elem.name.startswith('BLENDINDICES'):
+        return functools.partial(store_semantic_data, "blend_indices")
+    elif elem.name.startswith('BLENDWEIGHT'):
+        return functools.partial(store_semantic_data, "blend_weights")
+    elif elem.name.startswith('TEXCOORD') and elem.is_float():
+        return functools.partial(store_semantic_data, "texcoords")
+    elif elem.name.startswith('SHAPEKEY') and elem.is_float():
+        return functools.partial(store_semantic_data, "shapekeys")
+    else:
+        # 不认识的不导入
+        raise Fatal("Unknown ElementName: " + elem.name)
 
-def import_vertices(mesh, vb: VertexBuffer):
-    mesh.vertices.add(len(vb.vertices))
-    blend_indices = {}
-    blend_weights = {}
-    texcoords = {}
-    shapekeys = {}
-    use_normals = False
-    normals = []
 
-    for elem in vb.layout:
+def get_vertex_element_handler_list(layout) -> list:
+    '''
+    每个InputLayout只判断一次每个元素该怎么导入，返回[(elem, handler)]
+    '''
+    handler_list = []
+    for elem in layout:
         if elem.InputSlotClass != 'per-vertex':
             continue
+        handler = get_vertex_element_handler(elem)
+        if handler is not None:
+            handler_list.append((elem, handler))
+    return handler_list
+
+
+def import_vertices(mesh, vb: VertexBuffer, handler_list:list, loop_vertex_indices:numpy.ndarray):
+    mesh.vertices.add(vb.vertex_count)
+    vertex_data = {
+        "blend_indices": {},
+        "blend_weights": {},
+        "texcoords": {},
+        "shapekeys": {},
+        "use_normals": False,
+        "normals": [],
+    }
+
+    # handler_list在decode_3dmigoto_raw_buffers解析时就已经构建好了
+    for elem, handler in handler_list:
+        # (顶点数,分量数)的numpy数组，在parse_vb_bin时已经解析好了
+        handler(mesh, elem, vb.cols[elem.name], loop_vertex_indices, vertex_data)
+
+    return (vertex_data["blend_indices"], vertex_data["blend_weights"], vertex_data["texcoords"],
+            vertex_data["use_normals"], vertex_data["normals"], vertex_data["shapekeys"])
+
+
+def scan_texture_files(directory:str, texture_file_list:list):
+    '''
+    和os.walk的顺序一致：先是当前文件夹的文件，再按顺序递归子文件夹，符号链接的文件夹不进入
+    '''
+    sub_directory_list = []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    if not entry.is_symlink():
+                        sub_directory_list.append(entry.path)
+                else:
+                    texture_file_list.append((entry.name, entry.path))
+    except OSError:
+        return
+    for sub_directory in sub_directory_list:
+        scan_texture_files(sub_directory, texture_file_list)
 
-        data = tuple(x[elem.name] for x in vb.vertices)
-        if elem.name == 'POSITION':
-            # Ensure positions are 3-dimensional:
-            if len(data[0]) == 4:
-                if ([x[3] for x in data] != [1.0] * len(data)):
-                    raise Fatal('Positions are 4D')
-                    # Nico: Blender暂时不支持4D索引，加了也没用，直接不行就报错，转人工处理。
-            positions = [(x[0], x[1], x[2]) for x in data]
-            mesh.vertices.foreach_set('co', unpack_list(positions))
-        elif elem.name.startswith('COLOR'):
-            if len(data[0]) <= 3 or 4 == 4:
-                # Nico:实际执行过程中，几乎总会执行这里而不是下面的
-                # 即使是原版的也是设置vertex_color_layer_channels = 4 然后这里or进行比较的，所以总是会执行这里的设计。
-                # 如果是else下面的执行到会百分百报错的。
-                # Either a monochrome/RGB layer, or Blender 2.80 which uses 4
-                # channel layers
-                mesh.vertex_colors.new(name=elem.name)
-                color_layer = mesh.vertex_colors[elem.name].data
-                for l in mesh.loops:
-                    color_layer[l.index].color = list(data[l.vertex_index]) + [0] * (4 - len(data[l.vertex_index]))
-            else:
-                mesh.vertex_colors.new(name=elem.name + '.RGB')
-                mesh.vertex_colors.new(name=elem.name + '.A')
-                color_layer = mesh.vertex_colors[elem.name + '.RGB'].data
-                alpha_layer = mesh.vertex_colors[elem.name + '.A'].data
-                for l in mesh.loops:
-                    color_layer[l.index].color = data[l.vertex_index][:3]
-                    alpha_layer[l.index].color = [data[l.vertex_index][3], 0, 0]
-
-        elif elem.name == 'NORMAL':
-            use_normals = True
-            normals = [(x[0], x[1], x[2]) for x in data]
-
-
-
-        elif elem.name in ('TANGENT', 'BINORMAL'):
-            # 不需要导入TANGENT和BINORMAL，因为导出时会重新计算。
-            pass
-        elif elem.name.startswith('BLENDINDICES'):
-            blend_indices[elem.SemanticIndex] = data
-        elif elem.name.startswith('BLENDWEIGHT'):
-            blend_weights[elem.SemanticIndex] = data
-        elif elem.name.startswith('TEXCOORD') and elem.is_float():
-            texcoords[elem.SemanticIndex] = data
-        elif elem.name.startswith('SHAPEKEY') and elem.is_float():
-            shapekeys[elem.SemanticIndex] = data
-        else:
-            # 不认识的不导入
-            raise Fatal("Unknown ElementName: " + elem.name)
 
-    return (blend_indices, blend_weights, texcoords, use_normals,normals,shapekeys)
+@functools.lru_cache(maxsize=64)
+def index_texture_files(directory:str) -> tuple:
+    '''
+    每个文件夹只扫描一次，返回(文件名,完整路径)列表，每次导入开始时会清空缓存
+    '''
+    texture_file_list = []
+    scan_texture_files(directory, texture_file_list)
+    return tuple(texture_file_list)
 
 
 def find_texture(texture_prefix, texture_suffix, directory):
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            if file.endswith(texture_suffix) and file.startswith(texture_prefix):
-                texture_path = os.path.join(root, file)
-                return texture_path
+    for file, texture_path in index_texture_files(directory):
+        if file.endswith(texture_suffix) and file.startswith(texture_prefix):
+            return texture_path
     return None
 
 
@@ -258,21 +391,17 @@ def create_material_with_texture(obj, mesh_name:str, directory:str):
         material = bpy.data.materials.new(name=material_name)
         material.use_nodes = True
 
-        # Nico: Currently only support EN and ZH-CN
-        # 4.2 简体中文是 "原理化 BSDF" 英文是 "Principled BSDF"
-        bsdf = material.node_tree.nodes.get("原理化 BSDF")
-        if not bsdf: 
-            # 3.6 简体中文是原理化BSDF 没空格
-            bsdf = material.node_tree.nodes.get("原理化BSDF")
-        if not bsdf:
-            bsdf = material.node_tree.nodes.get("Principled BSDF")
+        # Nico: 节点名称会随界面语言变化，例如4.2简体中文是"原理化 BSDF"，3.6是"原理化BSDF"，英文是"Principled BSDF"
+        # 所以这里按节点类型查找，任何语言都能找到
+        bsdf = next((node for node in material.node_tree.nodes if node.type == 'BSDF_PRINCIPLED'), None)
 
         if bsdf:
             # Поиск текстуры (Search for textures)
 
             if texture_path:
                 tex_image = material.node_tree.nodes.new('ShaderNodeTexImage')
-                tex_image.image = bpy.data.images.load(texture_path)
+                # 多个部位经常共用同一张贴图，check_existing会复用已经按相同路径加载过的图片，不会重复读取
+                tex_image.image = bpy.data.images.load(texture_path, check_existing=True)
 
                 # 因为tga格式贴图有alpha通道，所以必须用CHANNEL_PACKED才能显示正常颜色
                 tex_image.image.alpha_mode = "CHANNEL_PACKED"
@@ -288,9 +417,90 @@ def create_material_with_texture(obj, mesh_name:str, directory:str):
         print(texture_path)
 
 
-def import_3dmigoto_raw_buffers(operator, context, fmt_path:str, vb_path:str, ib_path:str):
+def decode_3dmigoto_raw_buffers(fmt_path:str, vb_path:str, ib_path:str):
+    '''
+    只读取和解析.fmt .vb .ib文件，不访问bpy，所以可以放到后台线程中执行
+    返回(VertexBuffer, IndexBuffer, handler_list)，.vb或.ib文件为空或者byte offset之后没有数据时返回None
+    handler_list是get_vertex_element_handler_list的结果，import_vertices直接使用，不会重复构建
+    '''
+    # check if .ib .vb file is empty, skip empty import.
+    if os.path.getsize(vb_path) == 0 or os.path.getsize(ib_path) == 0:
+        return None
+
+    # .fmt只解析一次，VertexBuffer和IndexBuffer共用
+    fmt_file = FmtFile.from_fmt(fmt_path)
+
+    # .vb和.ib直接mmap后交给numpy解释，不需要先整个读成bytes
+    # 只解析导入时真正用到的元素，TANGENT BINORMAL以及非per-vertex的元素不解析
+    # 每个元素的导入函数在这里只判断一次，和解析结果一起返回给import_vertices使用
+    vb = VertexBuffer(fmt_file)
+    handler_list = get_vertex_element_handler_list(vb.layout)
+    import_element_names = set(elem.name for elem, handler in handler_list)
+    with open(vb_path, 'rb') as vb_file, mmap.mmap(vb_file.fileno(), 0, access=mmap.ACCESS_READ) as vb_buffer:
+        vb.parse_vb_bin(vb_buffer, element_names=import_element_names)
+
+    ib = IndexBuffer(fmt_file)
+    with open(ib_path, 'rb') as ib_file, mmap.mmap(ib_file.fileno(), 0, access=mmap.ACCESS_READ) as ib_buffer:
+        ib.parse_ib_bin(ib_buffer)
+
+    # byte offset超出文件长度时解析出来是空的，和空文件一样跳过
+    if vb.vertex_count == 0 or len(ib.faces) == 0:
+        return None
+
+    return (vb, ib, handler_list)
+
+
+class RawBufferPrefetcher:
+    '''
+    一键导入工作空间时，在后台线程中提前解析后面几个要导入的模型文件
+    主线程在创建当前Blender物体的同时，后面的文件读取和numpy解析已经在进行了
+    创建Blender物体的部分必须在主线程中执行
+    '''
+    def __init__(self, path_tuple_list:list, max_workers:int):
+        # (fmt_path, vb_path, ib_path)按导入顺序排列
+        self.path_tuple_list = path_tuple_list
+        self.path_tuple_index_dict = {path_tuple: index for index, path_tuple in enumerate(path_tuple_list)}
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        # 同时最多提前解析这么多个，避免整个工作空间的数据全部堆在内存里
+        self.prefetch_count = max_workers * 2
+        self.future_dict = {}
+        self.next_submit_index = 0
+
+    def submit_until(self, index:int):
+        while self.next_submit_index < len(self.path_tuple_list) and self.next_submit_index <= index:
+            path_tuple = self.path_tuple_list[self.next_submit_index]
+            self.future_dict[path_tuple] = self.executor.submit(decode_3dmigoto_raw_buffers, *path_tuple)
+            self.next_submit_index = self.next_submit_index + 1
+
+    def get(self, fmt_path:str, vb_path:str, ib_path:str):
+        path_tuple = (fmt_path, vb_path, ib_path)
+        index = self.path_tuple_index_dict.get(path_tuple)
+        if index is None:
+            return decode_3dmigoto_raw_buffers(fmt_path, vb_path, ib_path)
+        self.submit_until(index + self.prefetch_count)
+        future = self.future_dict.pop(path_tuple, None)
+        if future is None:
+            return decode_3dmigoto_raw_buffers(fmt_path, vb_path, ib_path)
+        # 后台线程中抛出的Fatal会在这里重新抛出
+        return future.result()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+def import_3dmigoto_raw_buffers(operator, context, fmt_path:str, vb_path:str, ib_path:str, decoded_buffers=None):
+    '''
+    decoded_buffers是decode_3dmigoto_raw_buffers的返回值，为None时在这里读取解析
+    '''
     operator.report({'INFO'}, "Import From " + fmt_path)
     TimerUtils.Start("import_3dmigoto_raw_buffers")
+
+    if decoded_buffers is None:
+        # create vb and ib class and read data.
+        TimerUtils.Start("Read VB Data") # 1.0636
+        decoded_buffers = decode_3dmigoto_raw_buffers(fmt_path, vb_path, ib_path)
+        TimerUtils.End("Read VB Data")
+
     # get import prefix
     mesh_name = os.path.basename(fmt_path)
     if mesh_name.endswith(".fmt"):
@@ -303,20 +513,13 @@ def import_3dmigoto_raw_buffers(operator, context, fmt_path:str, vb_path:str, ib
     obj = bpy.data.objects.new(mesh.name, mesh)
 
     # Nico: 虽然每个游戏导入时的坐标不一致，导致模型朝向都不同，但是不在这里修改，而是在后面根据具体的游戏进行扶正
-    obj.matrix_world = axis_conversion(from_forward='-Z', from_up='Y').to_4x4()
+    obj.matrix_world = _AXIS_CONV_4x4
 
-    # check if .ib .vb file is empty, skip empty import.
-    if os.path.getsize(vb_path) == 0 or os.path.getsize(ib_path) == 0:
+    # .ib .vb文件为空时decode返回None，跳过
+    if decoded_buffers is None:
         return obj
 
-    # create vb and ib class and read data. TODO 这里耗时过于长了。
-    TimerUtils.Start("Read VB Data") # 1.0636
-    vb = VertexBuffer(open(fmt_path, 'r'))
-    vb.parse_vb_bin(open(vb_path, 'rb'))
-    TimerUtils.End("Read VB Data")
-
-    ib = IndexBuffer(open(fmt_path, 'r'))
-    ib.parse_ib_bin(open(ib_path, 'rb'))
+    (vb, ib, handler_list) = decoded_buffers
 
     # 设置GameTypeName，方便在Catter的Properties面板中查看
     obj['3DMigoto:GameTypeName'] = ib.gametypename
@@ -326,11 +529,11 @@ def import_3dmigoto_raw_buffers(operator, context, fmt_path:str, vb_path:str, ib
     obj["3DMigoto:RecalculateCOLOR"] = False
 
     # post process for import data.
-    import_faces_from_ib(mesh, ib)
+    loop_vertex_indices = import_faces_from_ib(mesh, ib)
 
-    (blend_indices, blend_weights, texcoords, use_normals, normals, shapekeys) = import_vertices(mesh, vb)
+    (blend_indices, blend_weights, texcoords, use_normals, normals, shapekeys) = import_vertices(mesh, vb, handler_list, loop_vertex_indices)
 
-    import_uv_layers(mesh, obj, texcoords)
+    import_uv_layers(mesh, obj, texcoords, loop_vertex_indices)
 
     #  metadata.json, if contains then we can import merged vgmap.
     # TimerUtils.Start("Read Metadata")
@@ -377,12 +580,6 @@ def import_3dmigoto_raw_buffers(operator, context, fmt_path:str, vb_path:str, ib
     if ImportModelConfig.import_flip_scale_x():
         obj.scale.x = obj.scale.x * -1
 
-    # Flush every time export
-    # bpy.context.view_layer.update()
-
-    # Force flush makes better user experience.
-    # bpy.ops.wm.redraw_timer(type='DRAW_WIN_SWAP', iterations=1)
-
     TimerUtils.End("import_3dmigoto_raw_buffers")
     return obj
 
@@ -458,6 +655,9 @@ class Import3DMigotoRaw(bpy.types.Operator, ImportHelper):
                 import_filename_list.append(fmtfile.name)
 
 
+        # 贴图文件可能在两次导入之间被转换出来，所以每次导入都重新扫描
+        index_texture_files.cache_clear()
+
         done = set()
         for fmt_file_name in import_filename_list:
             
@@ -466,7 +666,7 @@ class Import3DMigotoRaw(bpy.types.Operator, ImportHelper):
                 (vb_path, ib_path, fmt_path) = self.get_vb_ib_paths_from_fmt_prefix(fmt_file_path)
                 if os.path.normcase(vb_path) in done:
                     continue
-                done.add(os.path.normcase(fmt_path))
+                done.add(os.path.normcase(vb_path))
 
                 if fmt_path is not None:
                     # 导入的调用链就从这里开始
@@ -488,12 +688,23 @@ class Import3DMigotoRaw(bpy.types.Operator, ImportHelper):
         return {'FINISHED'}
 
 
+def get_workspace_prefix_paths(import_folder_path:str, prefix:str):
+    '''
+    返回工作空间中某个prefix对应的(.vb路径, .ib路径, .fmt路径)
+    '''
+    prefix_path = os.path.join(import_folder_path, prefix)
+    return (prefix_path + '.vb', prefix_path + '.ib', prefix_path + '.fmt')
+
+
 def ImprotFromWorkSpace(self, context):
     import_drawib_aliasname_folder_path_dict = ImportUtils.get_import_drawib_aliasname_folder_path_dict_with_first_match_type()
     print(import_drawib_aliasname_folder_path_dict)
 
     workspace_collection = CollectionUtils.new_workspace_collection()
 
+    # 贴图文件可能在两次导入之间被转换出来，所以每次导入都重新扫描
+    index_texture_files.cache_clear()
+
     # 读取时保存每个DrawIB对应的GameType名称到工作空间文件夹下面的Import.json，在导出时使用
     draw_ib_gametypename_dict = {}
     for draw_ib_aliasname,import_folder_path in import_drawib_aliasname_folder_path_dict.items():
@@ -507,53 +718,73 @@ def ImprotFromWorkSpace(self, context):
     JsonUtils.SaveToFile(json_dict=draw_ib_gametypename_dict,filepath=save_import_json_path)
     
 
-    # 开始读取模型数据
+    # 先按导入顺序收集所有需要导入的文件，交给后台线程提前读取解析
+    prefetch_path_tuple_list = []
+    prefetch_vb_bin_path_key_set = set()
     for draw_ib_aliasname,import_folder_path in import_drawib_aliasname_folder_path_dict.items():
-        import_prefix_list = ImportUtils.get_prefix_list_from_tmp_json(import_folder_path)
-        if len(import_prefix_list) == 0:
-            self.report({'ERROR'},"当前output文件夹"+draw_ib_aliasname+"中的内容暂不支持一键导入分支模型")
-            continue
-
-        draw_ib_collection = CollectionUtils.new_draw_ib_collection(collection_name=draw_ib_aliasname)
-        workspace_collection.children.link(draw_ib_collection)
+        for prefix in ImportUtils.get_prefix_list_from_tmp_json(import_folder_path):
+            (vb_bin_path, ib_bin_path, fmt_path) = get_workspace_prefix_paths(import_folder_path, prefix)
+            vb_bin_path_key = os.path.normcase(vb_bin_path)
+            if vb_bin_path_key in prefetch_vb_bin_path_key_set:
+                continue
+            if os.path.exists(vb_bin_path) and os.path.exists(ib_bin_path) and os.path.exists(fmt_path):
+                prefetch_vb_bin_path_key_set.add(vb_bin_path_key)
+                prefetch_path_tuple_list.append((fmt_path, vb_bin_path, ib_bin_path))
 
-        part_count = 1
-        for prefix in import_prefix_list:
-            component_name = "Component " + str(part_count)
-            component_collection = CollectionUtils.new_component_collection(component_name=component_name)
-            defualt_switch_collection = CollectionUtils.new_switch_collection(collection_name="default")
+    raw_buffer_prefetcher = RawBufferPrefetcher(prefetch_path_tuple_list, max_workers=min(4, os.cpu_count() or 1))
 
-            # combine and verify if path exists.
-            vb_bin_path = import_folder_path + "\\" + prefix + '.vb'
-            ib_bin_path = import_folder_path + "\\" + prefix + '.ib'
-            fmt_path = import_folder_path + "\\" + prefix + '.fmt'
-
-            if not os.path.exists(vb_bin_path):
-                raise Fatal('Unable to find matching .vb file for %s' % import_folder_path + "\\" + prefix)
-            if not os.path.exists(ib_bin_path):
-                raise Fatal('Unable to find matching .ib file for %s' % import_folder_path + "\\" + prefix)
-            if not os.path.exists(fmt_path):
-                fmt_path = None
-
-            done = set()
-            try:
-                if os.path.normcase(vb_bin_path) in done:
-                    continue
-                done.add(os.path.normcase(vb_bin_path))
-                if fmt_path is not None:
-                    obj_result = import_3dmigoto_raw_buffers(self, context, fmt_path=fmt_path, vb_path=vb_bin_path,
-                                                                ib_path=ib_bin_path)
-                    defualt_switch_collection.objects.link(obj_result)
+    # 开始读取模型数据
+    # 整个工作空间共用一个done，同一份.vb只导入一次
+    done = set()
+    try:
+        for draw_ib_aliasname,import_folder_path in import_drawib_aliasname_folder_path_dict.items():
+            import_prefix_list = ImportUtils.get_prefix_list_from_tmp_json(import_folder_path)
+            if len(import_prefix_list) == 0:
+                self.report({'ERROR'},"当前output文件夹"+draw_ib_aliasname+"中的内容暂不支持一键导入分支模型")
+                continue
+
+            draw_ib_collection = CollectionUtils.new_draw_ib_collection(collection_name=draw_ib_aliasname)
+            workspace_collection.children.link(draw_ib_collection)
+
+            part_count = 1
+            for prefix in import_prefix_list:
+                component_name = "Component " + str(part_count)
+                component_collection = CollectionUtils.new_component_collection(component_name=component_name)
+                defualt_switch_collection = CollectionUtils.new_switch_collection(collection_name="default")
+
+                # combine and verify if path exists.
+                (vb_bin_path, ib_bin_path, fmt_path) = get_workspace_prefix_paths(import_folder_path, prefix)
+
+                if not os.path.exists(vb_bin_path):
+                    raise Fatal('Unable to find matching .vb file for %s' % os.path.join(import_folder_path, prefix))
+                if not os.path.exists(ib_bin_path):
+                    raise Fatal('Unable to find matching .ib file for %s' % os.path.join(import_folder_path, prefix))
+                if not os.path.exists(fmt_path):
+                    fmt_path = None
+
+                try:
+                    vb_bin_path_key = os.path.normcase(vb_bin_path)
+                    if vb_bin_path_key in done:
+                        # 已经导入过的不重复导入，但集合结构和Component编号保持不变
+                        pass
+                    elif fmt_path is not None:
+                        decoded_buffers = raw_buffer_prefetcher.get(fmt_path, vb_bin_path, ib_bin_path)
+                        obj_result = import_3dmigoto_raw_buffers(self, context, fmt_path=fmt_path, vb_path=vb_bin_path,
+                                                                    ib_path=ib_bin_path, decoded_buffers=decoded_buffers)
+                        defualt_switch_collection.objects.link(obj_result)
+                        done.add(vb_bin_path_key)
                         
-                else:
-                    self.report({'ERROR'}, "Can't find .fmt file!")
+                    else:
+                        self.report({'ERROR'}, "Can't find .fmt file!")
                 
-                component_collection.children.link(defualt_switch_collection)
-                draw_ib_collection.children.link(component_collection)
-            except Fatal as e:
-                self.report({'ERROR'}, str(e))
-
-            part_count = part_count + 1
+                    component_collection.children.link(defualt_switch_collection)
+                    draw_ib_collection.children.link(component_collection)
+                except Fatal as e:
+                    self.report({'ERROR'}, str(e))
+
+                part_count = part_count + 1
+    finally:
+        raw_buffer_prefetcher.shutdown()
 
     bpy.context.scene.collection.children.link(workspace_collection)
 